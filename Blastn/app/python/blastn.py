@@ -1,126 +1,1363 @@
 # blastn nucleotide
-with open("database.txt", "r") as file:
-    database = [line.strip() for line in file if line.strip()]
+import argparse
+import heapq
+import os
+import sys
+from bisect import bisect_left
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+
+import blastn_bitpar
+import blastn_bloom
+import blastn_chunk
+import blastn_dust
+import blastn_exact
+import blastn_index
+import blastn_minimizer
+import blastn_packed
+import blastn_prefetch
+import blastn_profile
+import blastn_sa
+
 query_sequence = "AGCTGAC"
-words = []
-results = []
-filtered_results = []
-best_results = []
-hsp_list = []
 kmer = 3
-print(len(database))
-
-def preprocess_query():
-    for i in range(len(query_sequence) - (kmer - 1)):
-        words.append(query_sequence[i:i + kmer])
-    print(words)
-
-
-def seed_searching():
-    for subject_index,subject in enumerate(database):
-        for word_index,word in enumerate(words):
-            hsp_list_temp = []
-            # word_score_max = 0
-            for i in range(len(subject)-(kmer - 1)):
-                match = True
-                for k in range(kmer):
-                    if subject[i+k] != word[k]:
-                        match = False
-                        break
-                if match:
-                    hsp_list_temp.append([kmer,subject_index,word_index,i])
-            hsp_list.extend(hsp_list_temp)
-    print(hsp_list)
+gap_thre = 3
+gapped_xdrop = 30
+batch_size = 4096
+# bases either side of a subject window (--chunk); at least the longest query
+chunk_overlap = 1000
+# per-search parameters; Searcher.search() takes overrides of any of them
+default_params = {
+    # X-drop: stop once the score falls this far below the best seen so far
+    "xdrop": 20,
+    # "scalar" extends one HSP at a time; "numpy" extends batches of HSPs;
+    # "packed" compares 2-bit packed words, 16 bases at a time, once a walk
+    # outlasts its first 16 steps
+    "engine": "scalar",
+    # two-hit seeding: extend only when two non-overlapping hits share a
+    # diagonal within this many bases (0 extends every hit)
+    "two_hit": 0,
+    # skip hits that fall inside an extension already made on their diagonal
+    "dedup": True,
+    # banded gapped extension of HSPs scoring above gap_thre (needs numpy)
+    "gapped": False,
+    "band": 16,
+    # keep only the K highest-scoring results (0 keeps all)
+    "top": 0,
+    # keep at most this many results from any one subject (0 for no cap)
+    "per_subject": 0,
+    # "plus" searches the query as given; "both" also searches its reverse
+    # complement in the same pass over the index
+    "strand": "plus",
+    # DUST level for masking low-complexity query regions (0 masks nothing)
+    "dust": 0,
+    # seed once per maximal exact match instead of once per word
+    # (contiguous words only)
+    "mem": False,
+    # report verbatim occurrences of the whole query found by substring
+    # search, and seed only the subjects without one
+    "exact": False,
+    # (lo, hi) subject range to search; None searches the whole database
+    "shard": None,
+}
+# 2-bit encoding shared with the accelerator (unpack_data / cal_hash_key)
+base_code = {"A": 0, "C": 1, "G": 2, "T": 3}
+# complement is 3 - code; other bases are left as they are
+complement = str.maketrans("ACGT", "TGCA")
 
 
+def search_params(params=None):
+    merged = dict(default_params)
+    if params:
+        unknown = set(params) - set(default_params)
+        if unknown:
+            raise ValueError(f"unknown search parameters: {sorted(unknown)}")
+        merged.update(params)
+    if merged["strand"] not in ("plus", "both"):
+        raise ValueError(f"strand must be 'plus' or 'both': {merged['strand']!r}")
+    return merged
 
-def extend_alignment():
-    gap_thre = 3
-    for i in range (len(hsp_list)):
 
-        word_index = hsp_list[i][2]
-        word = words[word_index]
-        subject_index = hsp_list[i][1]
-        subject = database[subject_index]
-        subject_pos = hsp_list[i][3]
+def preprocess_query(query, k=kmer):
+    return [query[i:i + k] for i in range(len(query) - (k - 1))]
 
-        alignment_score = kmer
-        alignment_thre = -50
-        q_left = word_index -1
-        s_left = subject_pos -1
-        while q_left >= 0 and s_left >= 0 and alignment_score > alignment_thre:
-            if (query_sequence[q_left] == subject[s_left]):
-                alignment_score += 1
 
-            else:
-                alignment_score += -3
-            q_left -= 1
-            s_left -= 1
+def reverse_complement(seq):
+    return seq.translate(complement)[::-1]
 
-        q_right = word_index + kmer
-        s_right = subject_pos + kmer
-        while q_right < len(query_sequence) and s_right < len(subject) and alignment_score > alignment_thre:
-            if (query_sequence[q_right] == subject[s_right]):
-                alignment_score += 1
 
-            else:
-                alignment_score += -3
+def kmer_codes(seq, k=kmer):
+    # rolling 2-bit code of every k-mer, skipping k-mers with non-ACGT bases
+    mask = (1 << (2 * k)) - 1
+    code = 0
+    valid = 0
+    for pos, base in enumerate(seq):
+        b = base_code.get(base)
+        if b is None:
+            valid = 0
+            continue
+        code = ((code << 2) | b) & mask
+        valid += 1
+        if valid >= k:
+            yield pos - (k - 1), code
+
+
+def kmer_code(word):
+    code = 0
+    for base in word:
+        b = base_code.get(base)
+        if b is None:
+            return None
+        code = (code << 2) | b
+    return code
+
+
+def seed_positions(seed):
+    # Spaced-seed template such as "11011011": a word covers len(seed)
+    # bases but only matches on the 1 positions, so hits tolerate
+    # mismatches at the 0 positions.
+    if not seed or set(seed) - {"0", "1"} or seed[0] != "1" or seed[-1] != "1":
+        raise ValueError(f"spaced seed must be 0s and 1s starting and ending in 1: {seed!r}")
+    return [i for i, c in enumerate(seed) if c == "1"]
+
+
+def seed_codes(seq, care, k):
+    # code of the care positions of every k-base window, skipping windows
+    # with non-ACGT bases there; contiguous seeds use the rolling code
+    if len(care) == k:
+        yield from kmer_codes(seq, k)
+        return
+    codes = [base_code.get(base) for base in seq]
+    for pos in range(len(seq) - k + 1):
+        code = 0
+        for i in care:
+            b = codes[pos + i]
+            if b is None:
+                break
+            code = (code << 2) | b
+        else:
+            yield pos, code
+
+
+def ungapped_extend(query, subject, word_index, subject_pos, k=kmer, xdrop=20, seed_score=None,
+                    stats=None):
+    # X-drop extension as in generate_extended_list (ubmark-blastn.c): the
+    # seed scores k (or seed_score for a spaced seed with mismatches), both
+    # directions advance in lockstep, and the alignment is trimmed back to
+    # the last position of the maximum score. The accelerators run the
+    # same walk without the seed bases. stats, if given, counts the bases
+    # compared and X-drop terminations.
+    alignment_score = k if seed_score is None else seed_score
+    max_score = alignment_score
+    max_q_left = word_index
+    max_s_left = subject_pos
+    max_len = k
+
+    q_left = word_index - 1
+    s_left = subject_pos - 1
+    q_right = word_index + k
+    s_right = subject_pos + k
+    final_q_left = word_index
+    final_s_left = subject_pos
+    final_q_right = word_index + k - 1
+
+    while True:
+        new_score = 0
+        can_left = q_left >= 0 and s_left >= 0
+        can_right = q_right < len(query) and s_right < len(subject)
+        if can_left:
+            new_score += 1 if query[q_left] == subject[s_left] else -3
+        if can_right:
+            new_score += 1 if query[q_right] == subject[s_right] else -3
+
+        if not (can_left or can_right) or max_score - (alignment_score + new_score) > xdrop:
+            break
+
+        alignment_score += new_score
+        if can_left:
+            final_q_left = q_left
+            final_s_left = s_left
+            q_left -= 1
+            s_left -= 1
+        if can_right:
+            final_q_right = q_right
             q_right += 1
             s_right += 1
+        if alignment_score >= max_score:
+            max_score = alignment_score
+            max_q_left = final_q_left
+            max_s_left = final_s_left
+            max_len = final_q_right - final_q_left + 1
 
-        aligned_query = query_sequence[q_left + 1:q_right]
-        aligned_subject = subject[s_left + 1:s_right]
+    if stats is not None:
+        dropped = can_left or can_right
+        stats["bases_compared"] += (word_index - 1 - q_left) + (q_right - word_index - k)
+        stats["bases_compared"] += can_left + can_right
+        stats["xdrop_terminations"] += dropped
+    return max_score, max_q_left, max_q_left + max_len, max_s_left
 
-        if alignment_score > gap_thre:
-            pass
-            # dp_table =
 
+class ExtendedTo:
+    # "Extended-up-to" record: the furthest subject position reached by an
+    # extension on each (subject, strand, diagonal). Hits arrive in subject
+    # order, so only the current subject is kept; a batch spanning several
+    # subjects records them all and then retains the last one.
 
-        # results.append([alignment_score,aligned_query,aligned_subject,subject_index,word_index,subject_pos])
-        identity = calculate_identity(aligned_query, aligned_subject)
-        results.append([alignment_score, aligned_query, aligned_subject, subject_index, word_index, subject_pos, identity])
+    def __init__(self, k):
+        self.k = k
+        self.subject_index = None
+        self.ends = {}
 
-    print(results)
-    if len(results) == 0:
-        print("none")
+    def covers(self, hsp):
+        key = (hsp[1], hsp[4], hsp[3] - hsp[2])
+        return hsp[3] + self.k <= self.ends.get(key, -1)
+
+    def record(self, hsp, s_start, length):
+        if hsp[1] != self.subject_index:
+            self.retain(hsp[1])
+        key = (hsp[1], hsp[4], hsp[3] - hsp[2])
+        self.ends[key] = max(self.ends.get(key, -1), s_start + length)
+
+    def retain(self, subject_index):
+        # forget the subjects before subject_index
+        self.subject_index = subject_index
+        self.ends = {key: end for key, end in self.ends.items() if key[0] >= subject_index}
 
-def filter():
+
+def filter(results, best_results=None):
+    # passes results above thre through and keeps the best-scoring ties
     max_score = -10
     thre = -10
-    for i in range(len(results)):
+    if best_results is None:
+        yield from (res for res in results if res.score > thre)
+        return
+    best_results.clear()
+    for res in results:
+        if res.score > thre:
+            yield res
+        if res.score > max_score:
+            best_results.clear()
+            best_results.append(res)
+            max_score = res.score
+        elif res.score == max_score:
+            best_results.append(res)
 
 
-        if results[i][0] > thre:
-            filtered_results.append(results[i])
-        if results[i][0] > max_score:
-            best_results.clear()
-            best_results.append(results[i])
-            max_score = results[i][0]
-        elif results[i][0] == max_score:
-            best_results.append(results[i])
-
-    print("best",best_results)
-    print("filtered",filtered_results)
-
-def calculate_identity(aligned_query, aligned_subject):
-    match_count = 0
-    for a, b in zip(aligned_query, aligned_subject):
-        if a == b:
-            match_count += 1
-    return (match_count / len(aligned_query)) * 100
-
-def print_result():
+class Hit:
+    # One result as coordinates only. The aligned strings are rebuilt from
+    # the query and database when a hit is printed, so a kept hit costs a
+    # few ints. ops is the gapped edit string ("M" aligned pair, "Q" query
+    # base against a gap, "S" subject base against a gap), or None for an
+    # ungapped hit; length counts alignment columns. Minus-strand hits
+    # (strand 1) are coordinates in the reverse-complemented query.
+    __slots__ = ("score", "q_start", "s_start", "length", "subject_index", "matches",
+                 "word_index", "subject_pos", "ops", "strand")
+
+    def __init__(self, score, q_start, s_start, length, subject_index, matches,
+                 word_index, subject_pos, ops=None, strand=0):
+        self.score = score
+        self.q_start = q_start
+        self.s_start = s_start
+        self.length = length
+        self.subject_index = subject_index
+        self.matches = matches
+        self.word_index = word_index
+        self.subject_pos = subject_pos
+        self.ops = ops
+        self.strand = strand
+
+    def identity(self):
+        return (self.matches / self.length) * 100
+
+    def aligned(self, query, database):
+        if self.strand:
+            query = reverse_complement(query)
+        subject = database[self.subject_index]
+        if self.ops is None:
+            return (query[self.q_start:self.q_start + self.length],
+                    subject[self.s_start:self.s_start + self.length])
+        aligned_query = []
+        aligned_subject = []
+        q, t = self.q_start, self.s_start
+        for op in self.ops:
+            if op == "S":
+                aligned_query.append("-")
+            else:
+                aligned_query.append(query[q])
+                q += 1
+            if op == "Q":
+                aligned_subject.append("-")
+            else:
+                aligned_subject.append(subject[t])
+                t += 1
+        return "".join(aligned_query), "".join(aligned_subject)
+
+    def as_list(self, query, database):
+        # [score, aligned query, aligned subject, subject, query position,
+        #  subject position, identity], the layout results are printed in,
+        # with "minus" appended for a minus-strand hit
+        aligned_query, aligned_subject = self.aligned(query, database)
+        row = [self.score, aligned_query, aligned_subject, self.subject_index,
+               self.word_index, self.subject_pos, self.identity()]
+        if self.strand:
+            row.append("minus")
+        return row
+
+
+class TopHits:
+    # Bounded top-K selection over a result stream, in O(K) memory. Each
+    # heap root is the weakest result kept: the lowest score and, among
+    # ties, the latest in subject order, so ties keep the earliest results
+    # like the serial scan. per_subject caps the results of any one subject;
+    # results arrive in subject order, so only the current subject's
+    # candidates are held apart.
+
+    def __init__(self, top=0, per_subject=0):
+        self.top = top
+        self.per_subject = per_subject
+        self.heap = []
+        self.subject_index = None
+        self.subject_heap = []
+
+    @staticmethod
+    def rank(res):
+        # higher score first, then (subject, strand, query position,
+        # subject position), which is the order the search produces results in
+        return (res.score, -res.subject_index, -res.strand, -res.word_index, -res.subject_pos)
+
+    @staticmethod
+    def keep(heap, limit, res):
+        entry = (TopHits.rank(res), res)
+        if limit <= 0 or len(heap) < limit:
+            heapq.heappush(heap, entry)
+        elif entry[0] > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+    def push(self, res):
+        if self.per_subject <= 0:
+            self.keep(self.heap, self.top, res)
+            return
+        if res.subject_index != self.subject_index:
+            self.flush()
+            self.subject_index = res.subject_index
+        self.keep(self.subject_heap, self.per_subject, res)
+
+    def extend(self, results):
+        for res in results:
+            self.push(res)
+
+    def flush(self):
+        for rank, res in self.subject_heap:
+            self.keep(self.heap, self.top, res)
+        self.subject_heap = []
+
+    def results(self):
+        # kept results, best first
+        self.flush()
+        return [res for rank, res in sorted(self.heap, key=lambda entry: entry[0], reverse=True)]
+
+
+def subject_strand(res):
+    return res.subject_index, res.strand
+
+
+def bounded(params):
+    return params["top"] > 0 or params["per_subject"] > 0
+
+
+def select(results, params, best_results):
+    # Streams every result when nothing is bounded; otherwise returns the
+    # TopHits selection, whose leading ties are the best results.
+    if not bounded(params):
+        return filter(results, best_results)
+    top = TopHits(params["top"], params["per_subject"])
+    top.extend(filter(results))
+    selected = top.results()
+    best_results[:] = [res for res in selected if res.score == selected[0].score] if selected else []
+    return selected
+
+
+class Searcher:
+    # Owns a loaded database and its k-mer index so any number of queries
+    # can be searched without reloading. All per-query state lives in the
+    # search call, so one Searcher can serve concurrent searches.
+
+    def __init__(self, database, k=kmer, database_path=None, index_cache=False,
+                 subject_range=None, seed=None, dust=0, suffix_array=False, minimizer=0,
+                 chunk=0, overlap=chunk_overlap, bloom=0):
+        # seed is a spaced-seed template; words then span len(seed) bases.
+        # dust is the DUST level masking low-complexity subject regions out
+        # of the index (0 masks nothing). suffix_array seeds from a suffix
+        # array stored next to the database instead of the k-mer index.
+        # minimizer is a window w: only the minimizer of every w words is
+        # indexed and searched (0 indexes every word). chunk splits subjects
+        # into windows of chunk bases plus overlap bases either side, which
+        # are indexed and searched as subjects of their own (0 keeps
+        # subjects whole); subject_range then counts windows. bloom builds
+        # per-subject Bloom filters of about bloom bits per word, with which
+        # batch searches skip subjects holding none of their words.
+        self.seed = seed
+        self.dust = dust
+        self.minimizer = minimizer
+        self.chunk = chunk
+        self.overlap = overlap
+        self.bloom = bloom
+        if seed is not None:
+            k = len(seed)
+            self.care = seed_positions(seed)
+        else:
+            self.care = list(range(k))
+        self.k = k
+        self.ignored = [i for i in range(k) if i not in self.care]
+        if chunk and overlap < k:
+            raise ValueError(f"window overlap {overlap} is shorter than a word")
+        self.set_database(database)
+        self.index_offsets = None
+        self.index_subjects = None
+        self.index_positions = None
+        self.suffix_array = None
+        self.filters = None
+        self.masks = None
+        self._digest = (None, None)
+        self._gapped_codes = (None, None)
+        self._packed_subject = (None, None)
+        if dust:
+            self.open_masks(database_path if index_cache or suffix_array else None)
+        if suffix_array:
+            if minimizer or chunk:
+                raise ValueError("minimizer sampling and subject windows apply to the "
+                                 "k-mer index, not the suffix array")
+            self.open_suffix_array(database_path)
+        else:
+            if index_cache and database_path is not None:
+                self.open_index_cache(database_path)
+            if self.index_offsets is None:
+                self.build_index(subject_range)
+        if bloom:
+            self.open_filters(database_path if index_cache else None)
+
+    @classmethod
+    def open(cls, path, k=kmer, index_cache=True, seed=None, dust=0, suffix_array=False,
+             minimizer=0, chunk=0, overlap=chunk_overlap, bloom=0):
+        return cls(load_database(path), k, database_path=path, index_cache=index_cache,
+                   seed=seed, dust=dust, suffix_array=suffix_array, minimizer=minimizer,
+                   chunk=chunk, overlap=overlap, bloom=bloom)
+
+    def set_database(self, database):
+        # subjects is the database results refer to; database is what gets
+        # indexed and searched, its windows when subjects are chunked
+        self.subjects = database
+        self.database = database
+        if self.chunk:
+            self.database = blastn_chunk.ChunkedDatabase(database, self.chunk, self.overlap)
+
+    def remap(self, results):
+        # results on the searched database as results on the subjects
+        if not self.chunk:
+            return results
+        return self.database.remap(results)
+
+    #---------------------------------------------------------------------
+    # index
+    #---------------------------------------------------------------------
+    # CSR k-mer index: hits for code c are entries offsets[c]..offsets[c+1].
+    # With a spaced seed the codes cover the care positions only; with a
+    # minimizer window only the sampled words are indexed.
+
+    def codes(self, seq):
+        return seed_codes(seq, self.care, self.k)
+
+    def word_code(self, word):
+        return kmer_code("".join(word[i] for i in self.care))
+
+    def sampled(self, codes, seq):
+        # the minimizers among codes of the words of seq, or every code
+        if not self.minimizer:
+            return codes
+        return blastn_minimizer.minimizers(codes, self.minimizer, 2 * len(self.care),
+                                           len(seq) - self.k + 1)
+
+    def index_codes(self, seq, runs=()):
+        # codes of the words of seq clear of the DUST-masked runs
+        return self.sampled(blastn_dust.unmasked(self.codes(seq), runs, self.k), seq)
+
+    def query_codes(self, seq, level):
+        return self.index_codes(seq, blastn_dust.dust_runs(seq, level) if level else ())
+
+    def subject_codes(self, subject_index, subject):
+        # the words the index holds; a subject's mask is computed only once
+        return self.index_codes(subject, self.masks[subject_index] if self.dust else ())
+
+    def open_masks(self, path):
+        # DUST masks of the searched subjects, stored next to the database
+        # when path is given, else each computed the first time it is used
+        if path is not None:
+            digest = self.content_hash(path)
+            chunk = (self.chunk, self.overlap) if self.chunk else None
+            mask_path = blastn_index.mask_path(path, digest, self.dust, chunk)
+            try:
+                if not os.path.exists(mask_path):
+                    blastn_index.write_masks(mask_path, self.dust, (
+                        blastn_dust.dust_runs(subject, self.dust)
+                        for subject_index, subject in blastn_prefetch.subjects(self.database)))
+                self.masks = blastn_index.MappedMasks(mask_path)
+                return
+            except OSError:
+                pass  # read-only location
+        self.masks = blastn_dust.SubjectMasks(self.database, self.dust)
+
+    def content_hash(self, path):
+        # the database is hashed once however many cache files it keys
+        cached = self._digest
+        if cached[0] != path:
+            cached = (path, blastn_index.content_hash(path))
+            self._digest = cached
+        return cached[1]
+
+    def build_index(self, subject_range=None):
+        # subject_range restricts the index to one shard of the database.
+        # Both passes read a packed database ahead in a background thread.
+        if subject_range is None:
+            subject_range = range(len(self.database))
+        table_size = 1 << (2 * len(self.care))
+        counts = array("q", [0]) * (table_size + 1)
+        for subject_index, subject in blastn_prefetch.subjects(self.database, subject_range):
+            for pos, code in self.subject_codes(subject_index, subject):
+                counts[code + 1] += 1
+        for c in range(table_size):
+            counts[c + 1] += counts[c]
+
+        fill = array("q", counts)
+        index_subjects = array("q", [0]) * counts[table_size]
+        index_positions = array("q", [0]) * counts[table_size]
+        for subject_index, subject in blastn_prefetch.subjects(self.database, subject_range):
+            for pos, code in self.subject_codes(subject_index, subject):
+                j = fill[code]
+                index_subjects[j] = subject_index
+                index_positions[j] = pos
+                fill[code] += 1
+        self.index_offsets = counts
+        self.index_subjects = index_subjects
+        self.index_positions = index_positions
+
+    def open_index_cache(self, path):
+        # Reuse (or create) the packed copy and k-mer index stored next to
+        # the database. Both are keyed by the database's content hash and k.
+        digest = self.content_hash(path)
+        packed_path, index_path = blastn_index.cache_paths(
+            path, digest, self.k, self.seed, self.dust, self.minimizer,
+            (self.chunk, self.overlap) if self.chunk else None)
+        try:
+            blastn_index.remove_stale(path, digest)
+            if not isinstance(self.subjects, blastn_packed.PackedDatabase):
+                no_pack_path = blastn_index.no_pack_path(path, digest)
+                if not os.path.exists(packed_path) and not os.path.exists(no_pack_path):
+                    try:
+                        blastn_index.write_atomic(
+                            packed_path, lambda tmp: blastn_packed.pack_database(path, tmp))
+                    except ValueError:
+                        # non-ACGT bases: keep searching the text database
+                        blastn_index.write_text(no_pack_path, "")
+                if os.path.exists(packed_path):
+                    self.set_database(blastn_packed.PackedDatabase(packed_path))
+            if not os.path.exists(index_path):
+                self.build_index()
+                blastn_index.write_index(index_path, self.k, self.index_offsets,
+                                         self.index_subjects, self.index_positions)
+        except OSError:
+            return  # read-only location: fall back to an in-memory index
+        index = blastn_index.MappedIndex(index_path)
+        self.index_offsets = index.offsets
+        self.index_subjects = index.subjects
+        self.index_positions = index.positions
+
+    def open_suffix_array(self, path):
+        # The suffix array is built once per database contents and DUST
+        # level and serves every word size.
+        if path is None:
+            raise ValueError("the suffix array is stored next to the database; "
+                             "give database_path")
+        if self.ignored:
+            raise ValueError("suffix array seeding needs contiguous words, not a spaced seed")
+        digest = self.content_hash(path)
+        blastn_index.remove_stale(path, digest)
+        sa_path = blastn_index.suffix_array_path(path, digest, self.dust)
+        if not os.path.exists(sa_path):
+            blastn_index.write_atomic(sa_path, lambda tmp: blastn_sa.write(
+                tmp, *blastn_sa.build(self.database, self.masks)))
+        self.suffix_array = blastn_sa.SuffixArray(sa_path)
+
+    def build_filters(self):
+        # (offsets, filter bytes) of the searched subjects, in one read-ahead pass
+        return blastn_bloom.build(
+            ((len(subject) - self.k + 1,
+              (code for pos, code in self.subject_codes(subject_index, subject)))
+             for subject_index, subject in blastn_prefetch.subjects(self.database)),
+            self.bloom)
+
+    def open_filters(self, path):
+        # Bloom filters stored next to the database when path is given,
+        # else built in memory
+        if path is not None:
+            digest = self.content_hash(path)
+            chunk = (self.chunk, self.overlap) if self.chunk else None
+            bloom_path = blastn_index.filter_path(path, digest, self.bloom, self.k, self.seed,
+                                                  self.dust, self.minimizer, chunk)
+            try:
+                if not os.path.exists(bloom_path):
+                    blastn_index.write_atomic(bloom_path, lambda tmp: blastn_bloom.write(
+                        tmp, self.bloom, *self.build_filters()))
+                self.filters = blastn_bloom.SubjectFilters.open(bloom_path)
+                return
+            except OSError:
+                pass  # read-only location
+        self.filters = blastn_bloom.SubjectFilters(*self.build_filters(), self.bloom)
+
+    #---------------------------------------------------------------------
+    # seeding
+    #---------------------------------------------------------------------
+
+    def word_hits(self, word_index, code, shard, strand=0):
+        if self.suffix_array is not None:
+            word = bytes((code >> (2 * i)) & 0x3 for i in reversed(range(self.k)))
+            for subject_index, pos in self.suffix_array.occurrences(word, shard):
+                yield [self.k, subject_index, word_index, pos, strand]
+            return
+        lo, hi = self.index_offsets[code], self.index_offsets[code + 1]
+        if shard is not None:
+            # runs are sorted by subject, so a shard is a contiguous slice
+            lo, hi = (bisect_left(self.index_subjects, s, lo, hi) for s in shard)
+        for j in range(lo, hi):
+            yield [self.k, self.index_subjects[j], word_index, self.index_positions[j], strand]
+
+    def query_words(self, query, params):
+        # (plus, minus) strand words of the query; masked words, and with a
+        # minimizer window the words that are not minimizers, are None
+        strands = [query]
+        if params["strand"] == "both":
+            strands.append(reverse_complement(query))
+        searched = []
+        for seq in strands:
+            words = preprocess_query(seq, self.k)
+            if params["dust"] or self.minimizer:
+                kept = {pos for pos, code in self.query_codes(seq, params["dust"])}
+                words = [word if pos in kept else None for pos, word in enumerate(words)]
+            searched.append(words)
+        if len(searched) == 1:
+            searched.append(())
+        return searched
+
+    def seed_searching(self, words, shard=None, minus_words=(), stats=None):
+        # Each word's index run is already sorted by (subject, position), so
+        # merging the runs streams hits subject by subject in the order of the
+        # original scan without materializing the whole hit list. Words of
+        # the reverse-complemented query (minus_words) join the same merge,
+        # so both strands come out of one pass over the index. Masked words
+        # are None and skipped. stats, if given, counts the words looked up.
+        runs = []
+        for strand, strand_words in enumerate((words, minus_words)):
+            for word_index, word in enumerate(strand_words):
+                if word is None:
+                    continue
+                code = self.word_code(word)
+                if code is not None:
+                    runs.append(self.word_hits(word_index, code, shard, strand))
+        if stats is not None:
+            stats["words"] += len(runs)
+        return heapq.merge(*runs, key=lambda hsp: (hsp[1], hsp[4], hsp[2]))
+
+    def maximal_matches(self, hsps, strands):
+        # One hit per maximal exact match. A word is kept only where the
+        # bases before it differ, then moved to the middle of its match so
+        # the lockstep extension grows the match evenly in both directions.
+        # The moved hits are put back in the (strand, word, position) order
+        # of word hits within each subject, which windowed searches
+        # (blastn_chunk) restore too.
+        if self.ignored:
+            raise ValueError("maximal exact match seeding needs contiguous words")
+        if self.minimizer:
+            raise ValueError("maximal exact match seeding needs every word indexed, "
+                             "not minimizers")
+
+        def moved(group):
+            for hsp in group:
+                query = strands[hsp[4]]
+                subject = self.database[hsp[1]]
+                word_index, subject_pos = hsp[2], hsp[3]
+                if (word_index and subject_pos
+                        and query[word_index - 1] == subject[subject_pos - 1]):
+                    continue
+                n = self.k
+                while (word_index + n < len(query) and subject_pos + n < len(subject)
+                       and query[word_index + n] == subject[subject_pos + n]):
+                    n += 1
+                shift = (n - self.k) // 2
+                yield [hsp[0], hsp[1], word_index + shift, subject_pos + shift, hsp[4]]
+
+        for _, group in groupby(hsps, key=lambda hsp: hsp[1]):
+            yield from sorted(moved(group), key=lambda hsp: (hsp[4], hsp[2], hsp[3]))
+
+    def suffix_array_matches(self, strand_words, strands, shard=None, stats=None):
+        # maximal_matches() of every word's hits, read off the suffix array:
+        # narrowing a word's interval as its match extends gives every
+        # occurrence's match length without touching the subjects. The
+        # hits come in the order maximal_matches() gives them; matches end
+        # at non-ACGT and DUST-masked bases, which the text holds as stops.
+        found = []
+        for strand, (words, seq) in enumerate(zip(strand_words, strands)):
+            codes = blastn_sa.query_codes(seq)
+            for word_index, word in enumerate(words):
+                if word is None:
+                    continue
+                if stats is not None:
+                    stats["words"] += 1
+                for n, p in self.suffix_array.maximal_matches(codes, word_index, self.k):
+                    subject_index, pos = self.suffix_array.locate(p)
+                    if shard is None or shard[0] <= subject_index < shard[1]:
+                        shift = (n - self.k) // 2
+                        found.append((subject_index, strand, word_index + shift, pos + shift))
+        found.sort()
+        for subject_index, strand, word_index, pos in found:
+            yield [self.k, subject_index, word_index, pos, strand]
+
+    def two_hit(self, hsps, window):
+        # last_hit[diagonal] is the subject position of the last hit kept on
+        # that diagonal. Hits overlapping it are dropped; a hit at most
+        # window after it triggers an extension. Within a subject and
+        # strand, hits on one diagonal arrive in increasing position order,
+        # so only the diagonals hit so far are held.
+        for _, group in groupby(hsps, key=lambda hsp: (hsp[1], hsp[4])):
+            last_hit = {}
+            for hsp in group:
+                subject_pos = hsp[3]
+                diag = subject_pos - hsp[2]
+                last = last_hit.get(diag, -1)
+                if last >= 0 and subject_pos - last < self.k:
+                    continue
+                last_hit[diag] = subject_pos
+                if last >= 0 and subject_pos - last <= window:
+                    yield hsp
+
+    #---------------------------------------------------------------------
+    # extension
+    #---------------------------------------------------------------------
+
+    def gapped_extend(self, query, subject_index, q_start, q_end, s_start, band):
+        # Re-extend an ungapped HSP with gaps from the middle of its segment.
+        # Returns the gapped score, start coordinates, edit string and the
+        # number of matching columns.
+        import blastn_numpy
+        subject = self.database[subject_index]
+        cached = self._gapped_codes
+        if cached[0] is not subject:
+            cached = (subject, blastn_numpy.codes(subject))
+            self._gapped_codes = cached
+        query_codes = blastn_numpy.codes(query)
+        half = (q_end - q_start) // 2
+        score, q0, q1, s0, s1, ops = blastn_numpy.banded_gapped_extend(
+            query_codes, cached[1], q_start + half, s_start + half, band, gapped_xdrop)
+
+        matches = 0
+        q, t = q0, s0
+        for op in ops:
+            if op == "M":
+                matches += query_codes[q] == cached[1][t]
+            if op != "S":
+                q += 1
+            if op != "Q":
+                t += 1
+        return score, q0, s0, "".join(ops), int(matches)
+
+    def make_result(self, query, params, alignment_score, q_start, q_end, s_start,
+                    subject_index, word_index, subject_pos, strand=0):
+        # query is the searched strand of the query
+        length = q_end - q_start
+        if params["gapped"] and alignment_score > gap_thre:
+            score, q0, s0, ops, matches = self.gapped_extend(
+                query, subject_index, q_start, q_end, s_start, params["band"])
+            return Hit(score, q0, s0, len(ops), subject_index, matches,
+                       word_index, subject_pos, ops, strand)
+        # ungapped columns score +1 or -3, so the extension's score and
+        # length already give its match count
+        matches = (alignment_score + 3 * length) // 4
+        return Hit(alignment_score, q_start, s_start, length, subject_index, matches,
+                   word_index, subject_pos, None, strand)
+
+    def packed_subject(self, subject_index):
+        # bit-parallel form of a subject, or None if it has non-ACGT bases
+        cached = self._packed_subject
+        if cached[0] != subject_index:
+            if isinstance(self.database, blastn_packed.PackedDatabase):
+                packed = blastn_bitpar.Sequence(self.database.packed(subject_index),
+                                                self.database.subject_length(subject_index))
+            else:
+                try:
+                    packed = blastn_bitpar.Sequence.from_str(self.database[subject_index])
+                except ValueError:
+                    packed = None
+            cached = (subject_index, packed)
+            self._packed_subject = cached
+        return cached[1]
+
+    def seed_score(self, query, subject_index, word_index, subject_pos):
+        # a spaced-seed hit may mismatch on the ignored positions
+        if not self.ignored:
+            return self.k
+        subject = self.database[subject_index]
+        score = len(self.care)
+        for i in self.ignored:
+            score += 1 if query[word_index + i] == subject[subject_pos + i] else -3
+        return score
+
+    def ungapped(self, query, packed_query, subject_index, word_index, subject_pos, xdrop,
+                 stats=None):
+        seed_score = self.seed_score(query, subject_index, word_index, subject_pos)
+        if packed_query is not None:
+            packed_subject = self.packed_subject(subject_index)
+            if packed_subject is not None:
+                return blastn_bitpar.extend(packed_query, packed_subject, word_index,
+                                            subject_pos, self.k, xdrop, seed_score, stats)
+        return ungapped_extend(query, self.database[subject_index], word_index, subject_pos,
+                               self.k, xdrop, seed_score, stats)
+
+    def extend_alignment(self, hsps, query, params, stats=None):
+        # Each hit is extended against the strand of the query it came
+        # from. stats, if given, is a profile's counters.
+        strands = (query, reverse_complement(query))
+        if params["engine"] == "numpy":
+            yield from self.extend_alignment_batched(hsps, strands, params, stats)
+            return
+        packed = (None, None)
+        if params["engine"] == "packed":
+            try:
+                packed = tuple(map(blastn_bitpar.Sequence.from_str, strands))
+            except ValueError:
+                pass  # non-ACGT query: compare characters instead
+        dedup = params["dedup"]
+        extended_to = ExtendedTo(self.k)
+        for hsp in hsps:
+            if dedup and extended_to.covers(hsp):
+                continue
+            word_index = hsp[2]
+            subject_index = hsp[1]
+            subject_pos = hsp[3]
+            strand = hsp[4]
+            if stats is not None:
+                stats["extensions"] += 1
+            score, q_start, q_end, s_start = self.ungapped(
+                strands[strand], packed[strand], subject_index, word_index, subject_pos,
+                params["xdrop"], stats)
+            extended_to.record(hsp, s_start, q_end - q_start)
+            yield self.make_result(strands[strand], params, score, q_start, q_end, s_start,
+                                   subject_index, word_index, subject_pos, strand)
+
+    def extend_alignment_batched(self, hsps, strands, params, stats=None):
+        # Same results as the scalar path, extending up to batch_size hits
+        # per numpy call. Whether dedup skips a hit only depends on the
+        # earlier extensions on its diagonal, so a window of hits is
+        # resolved in rounds: each round skips the covered hits at the head
+        # of every diagonal and extends the next uncovered one of each
+        # together. HSPs arrive in subject order, so a window only
+        # concatenates the few subjects it touches.
+        import numpy as np
+        import blastn_numpy
+        database = self.database
+        k = self.k
+        strand_codes = [blastn_numpy.codes(query) for query in strands]
+        extended_to = ExtendedTo(k)
+        hsps = iter(hsps)
+        while True:
+            window = list(islice(hsps, batch_size))
+            if not window:
+                break
+            n = len(window)
+            columns = np.array(window, dtype=np.int64).T
+            subject_indices, word_indices, subject_pos, strand_of = columns[1:]
+            bases = {}
+            chunks = []
+            base = 0
+            for subject_index, group in groupby(window, key=lambda hsp: hsp[1]):
+                bases[subject_index] = (base, len(database[subject_index]))
+                chunks.append(database[subject_index])
+                base += len(chunks[-1])
+            db_codes = blastn_numpy.codes("".join(chunks))
+            subject_base, subject_len = np.array([bases[hsp[1]] for hsp in window]).T
+            seed_scores = None
+            if self.ignored:
+                seed_scores = np.array([self.seed_score(strands[hsp[4]], hsp[1], hsp[2], hsp[3])
+                                        for hsp in window])
+            extents = np.zeros((4, n), dtype=np.int64)
+            extended = np.zeros(n, dtype=bool)
+
+            def extend(rows):
+                if stats is not None:
+                    stats["extensions"] += len(rows)
+                for strand in range(len(strands)):
+                    part = rows[strand_of[rows] == strand]
+                    if len(part):
+                        extents[:, part] = blastn_numpy.extend_batch(
+                            strand_codes[strand], db_codes, subject_base[part],
+                            subject_len[part], word_indices[part], subject_pos[part], k,
+                            params["xdrop"], None if seed_scores is None else seed_scores[part],
+                            stats)
+                extended[rows] = True
+
+            if not params["dedup"]:
+                extend(np.arange(n))
+            else:
+                # diagonals as contiguous groups of rows; a diagonal's hits
+                # come in increasing subject position
+                diagonal = subject_pos - word_indices
+                order = np.lexsort((np.arange(n), diagonal, strand_of, subject_indices))
+                sorted_keys = columns[[1, 4], :][:, order]
+                sorted_diagonal = diagonal[order]
+                new_group = np.ones(n, dtype=bool)
+                new_group[1:] = ((sorted_keys[:, 1:] != sorted_keys[:, :-1]).any(axis=0)
+                                 | (sorted_diagonal[1:] != sorted_diagonal[:-1]))
+                starts = np.flatnonzero(new_group)
+                stops = np.append(starts[1:], n)
+                keys = list(zip(sorted_keys[0, starts].tolist(), sorted_keys[1, starts].tolist(),
+                                sorted_diagonal[starts].tolist()))
+                ends = np.array([extended_to.ends.get(key, -1) for key in keys], dtype=np.int64)
+                # group g's rows sort as g * span + subject position
+                span = int(subject_pos.max()) + 1
+                group_of = np.cumsum(new_group) - 1
+                ranked = group_of * span + subject_pos[order]
+                head = starts.copy()
+                active = np.arange(len(starts))
+                while len(active):
+                    # skip the hits the diagonal's extensions already cover
+                    first = np.searchsorted(ranked, active * span + ends[active] - k + 1)
+                    head[active] = np.maximum(head[active], first)
+                    active = active[head[active] < stops[active]]
+                    if not len(active):
+                        break
+                    rows = order[head[active]]
+                    extend(rows)
+                    ends[active] = np.maximum(ends[active],
+                                              extents[3, rows] + extents[2, rows] - extents[1, rows])
+                    head[active] += 1
+                    active = active[head[active] < stops[active]]
+                for key, end in zip(keys, ends.tolist()):
+                    if end >= 0:
+                        extended_to.ends[key] = end
+                extended_to.retain(window[-1][1])
+            rows = np.flatnonzero(extended)
+            for row, (score, q_start, q_end, s_start) in zip(rows.tolist(),
+                                                             extents[:, rows].T.tolist()):
+                hsp = window[row]
+                yield self.make_result(strands[hsp[4]], params, score, q_start, q_end, s_start,
+                                       hsp[1], hsp[2], hsp[3], hsp[4])
+
+    #---------------------------------------------------------------------
+    # search
+    #---------------------------------------------------------------------
+
+    def stream(self, query, params, best_results, profile=None):
+        # seed -> two-hit -> extend -> filter -> select as one pipeline;
+        # best_results is filled with the best-scoring ties as it runs.
+        # profile, a blastn_profile.Profile, times the stages and counts
+        # their work.
+        if profile is None:
+            profile = blastn_profile.NullProfile()
+        self.check_overlap(query, params)
+        exact, matched = [], set()
+        if params["exact"]:
+            with profile.stage("exact_matches"):
+                exact, matched = self.exact_matches(query, params)
+        with profile.stage("preprocess_query"):
+            words, minus_words = self.query_words(query, params)
+        strands = (query, reverse_complement(query))
+        if params["mem"] and self.suffix_array is not None:
+            hsps = self.suffix_array_matches((words, minus_words), strands, params["shard"],
+                                             profile.counts)
+        else:
+            hsps = self.seed_searching(words, params["shard"], minus_words, profile.counts)
+        hsps = profile.timed("seed_searching", hsps, "seed_hits")
+        if matched:
+            hsps = self.unmatched(hsps, matched)
+        if params["mem"] and self.suffix_array is None:
+            hsps = profile.timed("seed_searching", self.maximal_matches(hsps, strands))
+        if params["two_hit"] > 0:
+            hsps = profile.timed("two_hit", self.two_hit(hsps, params["two_hit"]))
+        extended = profile.timed("extend_alignment",
+                                 self.remap(self.extend_alignment(hsps, query, params,
+                                                                  profile.counts)))
+        if exact:
+            extended = heapq.merge(exact, extended, key=subject_strand)
+        with profile.stage("filter"):
+            results = select(extended, params, best_results)
+        return profile.timed("filter", results, "results")
+
+    def exact_matches(self, query, params):
+        # Hits of the verbatim occurrences of the query (and of its reverse
+        # complement) in (subject, strand) order, and the (subject, strand)
+        # pairs they answer. With chunked subjects a shard reports the
+        # subjects whose first window it holds but still names every
+        # matched pair it touches.
+        if self.chunk:
+            windows = self.database.subjects
+            lo, hi = params["shard"] or (0, len(windows))
+            if lo >= hi:
+                return [], set()
+            subject_range = range(windows[lo], windows[hi - 1] + 1)
+            report = windows[lo] + (bisect_left(windows, windows[lo]) < lo)
+        else:
+            subject_range = range(*(params["shard"] or (0, len(self.subjects))))
+            report = subject_range.start
+        strands = [query]
+        if params["strand"] == "both":
+            strands.append(reverse_complement(query))
+        found = []
+        for strand, seq in enumerate(strands):
+            for subject_index, pos in blastn_exact.find(self.subjects, seq, subject_range):
+                found.append(Hit(len(seq), 0, pos, len(seq), subject_index, len(seq),
+                                 0, pos, None, strand))
+        found.sort(key=subject_strand)
+        matched = {subject_strand(res) for res in found}
+        return [res for res in found if res.subject_index >= report], matched
+
+    def unmatched(self, hsps, matched):
+        # hits on the subject strands not answered by exact matches
+        subjects = self.database.subjects if self.chunk else None
+        for hsp in hsps:
+            if ((hsp[1] if subjects is None else subjects[hsp[1]]), hsp[4]) not in matched:
+                yield hsp
+
+    def check_overlap(self, query, params):
+        # a window overlap shorter than an alignment could clip it
+        if not self.chunk:
+            return
+        longest = len(query) + (params["band"] if params["gapped"] else 0)
+        if longest > self.overlap:
+            raise ValueError(f"window overlap {self.overlap} is shorter than the longest "
+                             f"alignment of this query ({longest} bases)")
+
+    def search(self, query, params=None, profile=None):
+        # returns (results, best ties) for one query
+        params = search_params(params)
+        best_results = []
+        results = list(self.stream(query, params, best_results, profile))
+        return results, best_results
+
+    def batch_seed(self, queries, both_strands=False, dust=0, stats=None):
+        # Combined lookup of every query's words:
+        # code -> [(query id, offset, strand)]. Each subject is scanned once
+        # and its hits are dispatched to every matching query, in the
+        # (strand, word, position) order of a single search. Subjects are
+        # read ahead of the scan (blastn_prefetch); with Bloom filters the
+        # subjects that cannot hold any query word are neither read nor
+        # scanned. stats, if given, counts the words looked up and the hits.
+        lookup = {}
+        for query_id, query in enumerate(queries):
+            strands = (query, reverse_complement(query)) if both_strands else (query,)
+            for strand, seq in enumerate(strands):
+                for pos, code in self.query_codes(seq, dust):
+                    lookup.setdefault(code, []).append((query_id, pos, strand))
+        if stats is not None:
+            stats["words"] += sum(len(entries) for entries in lookup.values())
+        subject_indices = range(len(self.database))
+        if self.filters is not None:
+            may_hit = self.filters.probe(lookup)
+            subject_indices = [i for i in subject_indices if may_hit(i)]
+        for subject_index, subject in blastn_prefetch.subjects(self.database, subject_indices):
+            per_query = {}
+            # the words the index holds: DUST-masked words are left out,
+            # as is everything but the minimizers with a minimizer window
+            for pos, code in self.subject_codes(subject_index, subject):
+                for query_id, word_index, strand in lookup.get(code, ()):
+                    per_query.setdefault(query_id, []).append(
+                        [self.k, subject_index, word_index, pos, strand])
+            for hsps in per_query.values():
+                hsps.sort(key=lambda hsp: (hsp[4], hsp[2]))
+                if stats is not None:
+                    stats["seed_hits"] += len(hsps)
+            yield subject_index, per_query
+
+    def batch_search(self, queries, params=None, profile=None):
+        # (results, best ties) of every query from one pass over the database
+        params = search_params(params)
+        if profile is None:
+            profile = blastn_profile.NullProfile()
+        both_strands = params["strand"] == "both"
+        for query in queries:
+            self.check_overlap(query, params)
+        # bounded searches keep each query's selection as it goes
+        if bounded(params):
+            extended = [TopHits(params["top"], params["per_subject"]) for _ in queries]
+        else:
+            extended = [[] for _ in queries]
+        exact = [([], set())] * len(queries)
+        if params["exact"]:
+            exact = [self.exact_matches(query, params) for query in queries]
+        # exact hits join a query's results just before the seeded hits of
+        # their subject, so each subject's hits reach a bounded selection
+        # together
+        waiting = [list(reversed(exact_hits)) for exact_hits, matched in exact]
+
+        def release(query_id, subject_index):
+            hits = waiting[query_id]
+            while hits and hits[-1].subject_index <= subject_index:
+                extended[query_id].extend([hits.pop()])
+
+        seeded = profile.timed("seed_searching",
+                               self.batch_seed(queries, both_strands, params["dust"],
+                                               profile.counts))
+        for subject_index, per_query in seeded:
+            for query_id, hsps in per_query.items():
+                query = queries[query_id]
+                if exact[query_id][1]:
+                    release(query_id, self.database.subjects[subject_index] if self.chunk
+                            else subject_index)
+                    hsps = self.unmatched(hsps, exact[query_id][1])
+                if params["mem"]:
+                    hsps = self.maximal_matches(hsps, (query, reverse_complement(query)))
+                if params["two_hit"] > 0:
+                    hsps = self.two_hit(hsps, params["two_hit"])
+                results = profile.timed(
+                    "extend_alignment",
+                    self.remap(self.extend_alignment(hsps, query, params, profile.counts)))
+                extended[query_id].extend(results)
+        searched = []
+        for query_id, results in enumerate(extended):
+            release(query_id, len(self.subjects))
+            if isinstance(results, TopHits):
+                results = results.results()
+            elif self.chunk:
+                # windows of one subject were remapped one at a time
+                results.sort(key=lambda res: (res.subject_index,
+                                              blastn_chunk.search_order(res)))
+            elif params["exact"]:
+                # a subject's exact hits came in ahead of its other strand
+                results.sort(key=subject_strand)
+            best_results = []
+            results = profile.timed("filter", select(results, params, best_results), "results")
+            searched.append((list(results), best_results))
+        return searched
+
+
+#-------------------------------------------------------------------------
+# sharded search
+#-------------------------------------------------------------------------
+
+worker_database = None
+worker_searcher = None
+worker_options = {}
+
+
+def init_worker(database_path, index_cache, options):
+    # with the index cache every worker maps the same whole-database index;
+    # without it each shard gets its own small index. options are the
+    # Searcher index options (k, seed, dust, suffix_array, minimizer, chunk,
+    # overlap).
+    global worker_database, worker_searcher, worker_options
+    worker_options = options
+    if index_cache or options.get("suffix_array"):
+        worker_searcher = Searcher.open(database_path, **options)
+    else:
+        worker_database = load_database(database_path)
+
+
+def search_shard(lo, hi, query, params):
+    if worker_searcher is not None:
+        return worker_searcher.search(query, dict(params, shard=(lo, hi)))
+    searcher = Searcher(worker_database, subject_range=range(lo, hi), **worker_options)
+    return searcher.search(query, dict(params, shard=(lo, hi)))
+
+
+def parallel_search(database_path, n_subjects, jobs, query, params=None, index_cache=True,
+                    **options):
+    # Subjects are independent, so each worker indexes and searches its
+    # own contiguous shard. With chunked subjects n_subjects counts
+    # windows, so one long subject is split across workers. Shards come
+    # back in subject order, which lets the reduction reproduce the serial
+    # best-tie and top-K selection; a per-subject cap already holds since
+    # shards split on subjects.
+    params = search_params(params)
+    n_shards = max(1, min(n_subjects, jobs * 4))
+    bounds = [n_subjects * i // n_shards for i in range(n_shards + 1)]
+    with ProcessPoolExecutor(jobs, initializer=init_worker,
+                             initargs=(database_path, index_cache, options)) as executor:
+        shards = list(executor.map(search_shard, bounds[:-1], bounds[1:],
+                                   [query] * n_shards, [params] * n_shards))
+
+    results = [res for shard_results, shard_best in shards for res in shard_results]
+    best = [res for shard_results, shard_best in shards for res in shard_best]
+    if options.get("chunk"):
+        # a subject split across shards comes back in pieces
+        order = lambda res: (res.subject_index, blastn_chunk.search_order(res))
+        results.sort(key=order)
+        best.sort(key=order)
+    best_results = []
+    if bounded(params):
+        return select(results, params, best_results), best_results
+    if best:
+        max_score = max(res.score for res in best)
+        best_results = [res for res in best if res.score == max_score]
+    return results, best_results
+
+
+def print_result(filtered_results, best_results, query, database):
+    # alignment strings are only built here, for the hits being printed
+    count = 0
     for res in filtered_results:
-        score, q_align, s_align, subj_idx, q_idx, s_pos, identity = res
-        print(f"Score: {score}, Identity: {identity:.2f}%")
+        count += 1
+        q_align, s_align = res.aligned(query, database)
+        strand = ", Strand: minus" if res.strand else ""
+        print(f"Score: {res.score}, Identity: {res.identity():.2f}%")
         print(f"Aligned Query   : {q_align}")
         print(f"Aligned Subject : {s_align}")
-        print(f"Subject Sequence #: {subj_idx}, Query Position: {q_idx}, Subject Position: {s_pos}")
+        print(f"Subject Sequence #: {res.subject_index}, Query Position: {res.word_index}, "
+              f"Subject Position: {res.subject_pos}{strand}")
         print("-" * 50)
+    if count == 0:
+        print("none")
+    print("best", [res.as_list(query, database) for res in best_results])
+
+
+def load_database(path):
+    # packed databases are memory-mapped; text databases are one subject per line
+    if blastn_packed.is_packed(path):
+        return blastn_packed.PackedDatabase(path)
+    with open(path, "r") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="blastn nucleotide search")
+    parser.add_argument("database", nargs="?", default="database.txt")
+    parser.add_argument("--query", default=query_sequence)
+    parser.add_argument("--queries", metavar="FILE",
+                        help="search every query in FILE (one per line) in one database pass")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="search database shards in N worker processes")
+    parser.add_argument("--top", type=int, default=default_params["top"],
+                        help="report only the K highest-scoring hits")
+    parser.add_argument("--per-subject", type=int, default=default_params["per_subject"],
+                        metavar="N", help="report at most N hits from any one subject")
+    parser.add_argument("--engine", choices=["scalar", "numpy", "packed"],
+                        default=default_params["engine"],
+                        help="ungapped extension engine (numpy extends HSPs in batches, "
+                             "packed compares 16-base packed words in walks longer than "
+                             "16 steps)")
+    parser.add_argument("--strand", choices=["plus", "both"], default=default_params["strand"],
+                        help="also search the reverse complement of the query")
+    parser.add_argument("--two-hit", type=int, default=default_params["two_hit"], metavar="A",
+                        help="extend only pairs of hits on one diagonal within A bases")
+    parser.add_argument("--keep-redundant", action="store_true",
+                        help="extend every hit, even inside an earlier extension")
+    parser.add_argument("--gapped", action="store_true",
+                        help="banded gapped extension of HSPs above the gap trigger")
+    parser.add_argument("--band", type=int, default=default_params["band"],
+                        help="band width of the gapped extension")
+    parser.add_argument("--seed", metavar="TEMPLATE",
+                        help="spaced seed such as 11011011 instead of contiguous words")
+    parser.add_argument("--dust", type=int, nargs="?", const=blastn_dust.LEVEL, default=0,
+                        metavar="LEVEL",
+                        help="mask low-complexity regions of the query and database "
+                             f"before seeding (default level {blastn_dust.LEVEL})")
+    parser.add_argument("--suffix-array", action="store_true",
+                        help="seed from an on-disk suffix array that serves any word size")
+    parser.add_argument("--minimizer", type=int, default=0, metavar="W",
+                        help="index only the minimizer of every W words: a smaller index "
+                             "that can miss matches shorter than W + k - 1 bases")
+    parser.add_argument("--chunk", type=int, default=0, metavar="N",
+                        help="split subjects into windows of N bases searched independently")
+    parser.add_argument("--overlap", type=int, default=chunk_overlap, metavar="N",
+                        help="bases shared with each neighbouring window; at least the "
+                             f"longest query (default {chunk_overlap})")
+    parser.add_argument("--bloom", type=int, nargs="?", const=blastn_bloom.BITS_PER_WORD,
+                        default=0, metavar="BITS",
+                        help="with --queries, skip subjects whose Bloom filter (BITS per "
+                             f"word, default {blastn_bloom.BITS_PER_WORD}) rules out every "
+                             "query word")
+    parser.add_argument("--exact", action="store_true",
+                        help="report whole-query matches found by substring search and "
+                             "seed only the subjects without one")
+    parser.add_argument("--mem", action="store_true",
+                        help="seed once per maximal exact match instead of once per word")
+    parser.add_argument("--no-index-cache", action="store_true",
+                        help="do not store or reuse the on-disk index next to the database")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="write per-stage times and work counters to FILE as JSON "
+                             "(- for stderr)")
+    parser.add_argument("--pack", metavar="OUT",
+                        help="write the text database as a packed database and exit")
+    args = parser.parse_args()
+
+    if args.pack:
+        n = blastn_packed.pack_database(args.database, args.pack)
+        print(f"packed {n} subjects into {args.pack}")
+        return
+
+    params = search_params({
+        "top": args.top,
+        "per_subject": args.per_subject,
+        "strand": args.strand,
+        "engine": args.engine,
+        "two_hit": args.two_hit,
+        "dedup": not args.keep_redundant,
+        "gapped": args.gapped,
+        "band": args.band,
+        "dust": args.dust,
+        "mem": args.mem,
+        "exact": args.exact,
+    })
+    options = {"k": kmer, "seed": args.seed, "dust": args.dust,
+               "suffix_array": args.suffix_array, "minimizer": args.minimizer,
+               "chunk": args.chunk, "overlap": args.overlap}
+    index_cache = not args.no_index_cache
+    if args.jobs > 1 and args.queries:
+        parser.error("--queries searches in a single process (--jobs 1)")
+    profile = blastn_profile.NullProfile()
+    if args.profile:
+        if args.jobs > 1:
+            parser.error("--profile needs a single process (--jobs 1)")
+        profile = blastn_profile.Profile()
+    if args.jobs > 1:
+        # workers index their own shards; only the cache is built up front
+        database = load_database(args.database)
+        if index_cache or args.suffix_array:
+            database = Searcher(database, database_path=args.database,
+                                index_cache=index_cache, **options).subjects
+        n_shardable = len(database)
+        if args.chunk:
+            n_shardable = len(blastn_chunk.ChunkedDatabase(database, args.chunk, args.overlap))
+        print(len(database))
+        print(preprocess_query(args.query, len(args.seed) if args.seed else kmer))
+        print_result(*parallel_search(args.database, n_shardable, args.jobs,
+                                      args.query, params, index_cache, **options),
+                     args.query, database)
+        return
+
+    with profile.stage("load_database"):
+        searcher = Searcher.open(args.database, index_cache=index_cache,
+                                 bloom=args.bloom if args.queries else 0, **options)
+    print(len(searcher.subjects))
+
+    if args.queries:
+        with open(args.queries, "r") as file:
+            queries = [line.strip() for line in file if line.strip()]
+        searched = searcher.batch_search(queries, params, profile)
+        with profile.stage("output"):
+            for query_id, (results, best_results) in enumerate(searched):
+                print(f"Query #{query_id}: {queries[query_id]}")
+                print_result(results, best_results, queries[query_id], searcher.subjects)
+    else:
+        print(preprocess_query(args.query, searcher.k))
+        best_results = []
+        results = searcher.stream(args.query, params, best_results, profile)
+        with profile.stage("output"):
+            print_result(results, best_results, args.query, searcher.subjects)
+
+    if args.profile:
+        if args.profile == "-":
+            profile.dump(sys.stderr)
+        else:
+            with open(args.profile, "w") as file:
+                profile.dump(file)
 
 
-preprocess_query()
-seed_searching()
-extend_alignment()
-filter()
-print_result()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+# blastn bit-parallel engine
+#
+# Ungapped X-drop extension on the 2-bit packed form of blastn_packed,
+# the same layout the accelerator reads (base j of a byte in bits
+# [2j+1:2j], 16 bases per 32-bit word). As the walk advances it reads
+# the next 16 bases of each side, XORs them against the query and folds
+# them to a mismatch mask with one bit per base, so the walk consumes a
+# whole 16-step word when it is all matches and a 4-step block per table
+# lookup otherwise, and only reads as far as it goes. The left side is
+# read from the same forward buffer, with the mask of each word put in
+# walking order, so a subject is never copied. From a short seed most
+# walks stop a few steps in, before a word mask pays for itself, so the
+# first word of lockstep steps is taken one base at a time and only walks
+# still running after it go on a word at a time. The results are
+# identical to ungapped_extend().
+import blastn_packed
+
+# reverses the order of the four bases in a packed byte
+_reverse_byte = bytes(sum(((b >> (2 * j)) & 0x3) << (2 * (3 - j)) for j in range(4))
+                      for b in range(256))
+
+# per-step score of the 2-bit mismatch code of one step: bit 0 is the
+# left base, bit 1 the right base. One-sided steps only use bit 0.
+BOTH = (2, -2, -2, -6)
+ONE = (1, -3, 1, -3)
+WORD_STEPS = 16
+BLOCK_STEPS = 4
+
+
+def _block_table(deltas):
+    # (total, lowest prefix, largest drop below an earlier prefix, highest
+    # prefix, last step reaching it) of every 4-step block of mismatch codes
+    table = []
+    for key in range(1 << (2 * BLOCK_STEPS)):
+        score = 0
+        low = high = None
+        running = 0
+        drop = 0
+        arg = 0
+        for t in range(BLOCK_STEPS):
+            score += deltas[(key >> (2 * t)) & 0x3]
+            drop = max(drop, running - score)
+            running = max(running, score)
+            low = score if low is None else min(low, score)
+            if high is None or score >= high:
+                high, arg = score, t + 1
+        table.append((score, low, drop, high, arg))
+    return table
+
+
+_tables = {BOTH: _block_table(BOTH), ONE: _block_table(ONE)}
+
+# bit 2j set for each base j of an n-base run
+_low_bits = [((1 << (2 * n)) - 1) // 3 for n in range(WORD_STEPS + 1)]
+
+
+def mismatches(a, a_pos, b, b_pos, n):
+    # one bit (at 2j) per base of the n-base run where a and b differ;
+    # n is at most WORD_STEPS
+    x = ((int.from_bytes(a[a_pos // 4:(a_pos + n + 3) // 4], "little") >> (2 * (a_pos % 4)))
+         ^ (int.from_bytes(b[b_pos // 4:(b_pos + n + 3) // 4], "little") >> (2 * (b_pos % 4))))
+    return (x | (x >> 1)) & _low_bits[n]
+
+
+def mismatches_before(a, a_pos, b, b_pos, n):
+    # the same for the n bases before a_pos and b_pos, nearest first
+    x = mismatches(a, a_pos - n, b, b_pos - n, n) << (2 * (WORD_STEPS - n))
+    return int.from_bytes(x.to_bytes(4, "little").translate(_reverse_byte), "big")
+
+
+class Sequence:
+    # a packed sequence and its length in bases; packed is used as given.
+    # text is the sequence as a string if it is at hand, else None.
+
+    def __init__(self, packed, length, text=None):
+        self.packed = packed
+        self.length = length
+        self.text = text
+
+    @classmethod
+    def from_str(cls, seq):
+        # raises ValueError on non-ACGT bases
+        return cls(blastn_packed.pack_codes(blastn_packed.encode_codes(seq)), len(seq), seq)
+
+    def around(self, pos, k, n):
+        # (text, offset) holding the n bases either side of the k-base word
+        # at pos, where base i is text[i - offset]; only their bytes are
+        # decoded
+        start = pos - n
+        skip = start % 4
+        end = pos + k + n
+        text = blastn_packed.decode_packed(self.packed[start // 4:(end + 3) // 4],
+                                           skip + end - start)[skip:]
+        return text, start
+
+
+def _walk(mask, n, deltas, xdrop, state):
+    # Advance state [score, max score, step of max, steps done] over n
+    # steps of mismatch codes. Returns False where the X-drop stops it.
+    table = _tables[deltas]
+    word_gain = WORD_STEPS * deltas[0]
+    score, max_score, t_max, t = state
+    t_end = t + n
+    stopped = False
+    while t < t_end:
+        left = t_end - t
+        if left >= WORD_STEPS and not mask & 0xFFFFFFFF:
+            score += word_gain
+            t += WORD_STEPS
+            mask >>= 2 * WORD_STEPS
+            if score >= max_score:
+                max_score, t_max = score, t
+            continue
+        if left >= BLOCK_STEPS:
+            total, low, drop, high, arg = table[mask & 0xFF]
+            if max_score - score - low <= xdrop and drop <= xdrop:
+                if score + high >= max_score:
+                    max_score, t_max = score + high, t + arg
+                score += total
+                t += BLOCK_STEPS
+                mask >>= 2 * BLOCK_STEPS
+                continue
+        # single steps: the tail of a run, or a block the X-drop stops in
+        delta = deltas[mask & 0x3]
+        if max_score - (score + delta) > xdrop:
+            stopped = True
+            break
+        score += delta
+        t += 1
+        mask >>= 2
+        if score >= max_score:
+            max_score, t_max = score, t
+    state[:] = score, max_score, t_max, t
+    return not stopped
+
+
+def extend(query, subject, word_index, subject_pos, k, xdrop, seed_score=None, stats=None):
+    # query and subject are Sequence objects; returns
+    # (score, q_start, q_end, s_start) like ungapped_extend()
+    # conditionals rather than min(): most walks are only a few steps long
+    q_right = word_index + k
+    s_right = subject_pos + k
+    left_len = word_index if word_index < subject_pos else subject_pos
+    right_len = query.length - q_right
+    if subject.length - s_right < right_len:
+        right_len = subject.length - s_right
+    both = left_len if left_len < right_len else right_len
+
+    # single steps over the first word of lockstep steps
+    score = max_score = k if seed_score is None else seed_score
+    t_max = 0
+    n = both if both < WORD_STEPS else WORD_STEPS
+    q_text, q_offset = (query.text, 0) if query.text is not None else query.around(
+        word_index, k, n)
+    s_text, s_offset = (subject.text, 0) if subject.text is not None else subject.around(
+        subject_pos, k, n)
+    q_left, s_left = word_index - 1 - q_offset, subject_pos - 1 - s_offset
+    q_next, s_next = q_right - q_offset, s_right - s_offset
+    deltas = BOTH
+    running = True
+    t = 0
+    while t < n:
+        delta = deltas[(q_text[q_left - t] != s_text[s_left - t])
+                     | (q_text[q_next + t] != s_text[s_next + t]) << 1]
+        if max_score - (score + delta) > xdrop:
+            running = False
+            break
+        score += delta
+        t += 1
+        if score >= max_score:
+            max_score, t_max = score, t
+
+    # the rest a word at a time
+    if running and (t < left_len or t < right_len):
+        q, s = query.packed, subject.packed
+        state = [score, max_score, t_max, t]
+        while running and t < both:
+            n = min(WORD_STEPS, both - t)
+            mask = (mismatches_before(q, word_index - t, s, subject_pos - t, n)
+                    | mismatches(q, q_right + t, s, s_right + t, n) << 1)
+            running = _walk(mask, n, BOTH, xdrop, state)
+            t = state[3]
+        while running and t < left_len:
+            n = min(WORD_STEPS, left_len - t)
+            mask = mismatches_before(q, word_index - t, s, subject_pos - t, n)
+            running = _walk(mask, n, ONE, xdrop, state)
+            t = state[3]
+        while running and t < right_len:
+            n = min(WORD_STEPS, right_len - t)
+            mask = mismatches(q, q_right + t, s, s_right + t, n)
+            running = _walk(mask, n, ONE, xdrop, state)
+            t = state[3]
+        score, max_score, t_max, t = state
+
+    if stats is not None:
+        # the step the X-drop stops at is compared but not taken
+        seen = t + (not running)
+        stats["bases_compared"] += min(seen, left_len) + min(seen, right_len)
+        stats["xdrop_terminations"] += not running
+    n_left = t_max if t_max < left_len else left_len
+    n_right = t_max if t_max < right_len else right_len
+    return max_score, word_index - n_left, word_index + k + n_right, subject_pos - n_left
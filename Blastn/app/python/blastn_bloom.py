@@ -0,0 +1,120 @@
+# blastn subject Bloom filters
+#
+# One Bloom filter per subject over the codes of its words, so a batch
+# search skips the subjects that none of its query words can occur in
+# instead of scanning them. With a large k and many short subjects most
+# subjects hold no word of the queries at all.
+#
+# A subject's filter has a power-of-two number of bits, about
+# bits_per_word per word, and sets n_hashes bits per code by double
+# hashing one 64-bit hash. A code's mask therefore only depends on the
+# filter size, and a probe builds the masks of its codes once per size.
+#
+# File layout (little-endian): header magic b"BLNB", uint32 version,
+# uint32 bits per word, uint32 hashes, uint64 n_subjects, then int64 byte
+# offsets of the filters (n_subjects + 1) and the filters themselves.
+import math
+import mmap
+import struct
+from array import array
+
+MAGIC = b"BLNB"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIQ")
+BITS_PER_WORD = 8
+MIN_BITS = 64
+
+
+def n_hashes(bits_per_word):
+    # the false-positive optimum for a filter of bits_per_word bits per code
+    return max(1, round(bits_per_word * math.log(2)))
+
+
+def filter_bits(n_words, bits_per_word):
+    m = MIN_BITS
+    while m < n_words * bits_per_word:
+        m *= 2
+    return m
+
+
+def code_mask(code, hashes, m):
+    h = (code * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    h ^= h >> 31
+    h1 = h & 0xFFFFFFFF
+    h2 = (h >> 32) | 1
+    mask = 0
+    for i in range(hashes):
+        mask |= 1 << ((h1 + i * h2) & (m - 1))
+    return mask
+
+
+def build(subject_codes, bits_per_word=BITS_PER_WORD):
+    # (offsets, filter bytes) from (n_words, codes) of each subject
+    hashes = n_hashes(bits_per_word)
+    offsets = array("q", [0])
+    data = bytearray()
+    for n_words, codes in subject_codes:
+        m = filter_bits(n_words, bits_per_word)
+        bits = 0
+        for code in set(codes):
+            bits |= code_mask(code, hashes, m)
+        data += bits.to_bytes(m // 8, "little")
+        offsets.append(len(data))
+    return offsets, data
+
+
+def write(path, bits_per_word, offsets, data):
+    with open(path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, bits_per_word, n_hashes(bits_per_word),
+                              len(offsets) - 1))
+        offsets.tofile(out)
+        out.write(data)
+
+
+class SubjectFilters:
+    # The filters of every subject, in memory or mapped from a file.
+
+    def __init__(self, offsets, data, bits_per_word):
+        self.offsets = offsets
+        self.data = data
+        self.bits_per_word = bits_per_word
+        self.hashes = n_hashes(bits_per_word)
+        self._file = self._mmap = None
+
+    @classmethod
+    def open(cls, path):
+        file = open(path, "rb")
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(mapped)
+        magic, version, bits_per_word, hashes, n = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a blastn Bloom filter file")
+        end = HEADER.size + 8 * (n + 1)
+        filters = cls(buffer[HEADER.size:end].cast("q"), buffer[end:], bits_per_word)
+        filters._file, filters._mmap, filters._buffer = file, mapped, buffer
+        return filters
+
+    def probe(self, codes):
+        # may_hit(subject_index): whether any of codes can be a word of the
+        # subject; False means none is. Testing costs a step per code, so
+        # subjects with no more words than that are passed as they are.
+        codes = set(codes)
+        masks = {}
+
+        def may_hit(subject_index):
+            lo, hi = self.offsets[subject_index], self.offsets[subject_index + 1]
+            m = (hi - lo) * 8
+            if len(codes) >= m // self.bits_per_word:
+                return True
+            if m not in masks:
+                masks[m] = [code_mask(code, self.hashes, m) for code in codes]
+            bits = int.from_bytes(self.data[lo:hi], "little")
+            return any(bits & mask == mask for mask in masks[m])
+        return may_hit
+
+    def close(self):
+        if self._mmap is not None:
+            for view in (self.offsets, self.data, self._buffer):
+                view.release()
+            self._mmap.close()
+            self._file.close()
@@ -0,0 +1,99 @@
+# blastn subject windows
+#
+# Splits long subjects (whole chromosomes) into windows that blastn.py
+# indexes and searches as subjects of their own, so no step holds more
+# than one window of a subject. Window j of a subject owns the bases
+# [j * size, (j + 1) * size) and also holds overlap bases either side:
+#
+#   |<- overlap ->|<------- size ------->|<- overlap ->|
+#                 ^ owned region          ^ next window's owned region
+#
+# Every window is searched independently. A hit is reported only by the
+# window owning its seed position, which drops the copies found again in
+# the neighbouring windows' overlap, and is remapped to whole-subject
+# coordinates. An ungapped alignment is never longer than the query, so
+# with an overlap of at least the query length (plus the band when
+# gapped) no reported extension is clipped at a window edge.
+from array import array
+
+from blastn_packed import PackedDatabase
+
+
+def search_order(res):
+    # order of a subject's hits in an unwindowed search
+    return res.strand, res.word_index, res.subject_pos
+
+
+class ChunkedDatabase:
+    # Sequence view over the windows of a database; indexing returns the
+    # window's bases. The most recent window is cached, since the search
+    # walks hits window by window.
+
+    def __init__(self, database, size, overlap):
+        if size <= 0 or overlap < 0:
+            raise ValueError(f"bad window size {size} or overlap {overlap}")
+        self.database = database
+        self.size = size
+        self.overlap = overlap
+        self.subjects = array("q")  # subject of each window
+        self.begins = array("q")    # first base of the window in its subject
+        self.owned = array("q")     # first owned base; the region is size long
+        for subject_index in range(len(database)):
+            n = self.subject_length(subject_index)
+            for start in range(0, max(n, 1), size):
+                self.subjects.append(subject_index)
+                self.begins.append(max(0, start - overlap))
+                self.owned.append(start)
+        self._cached = (None, None)
+
+    def subject_length(self, subject_index):
+        if isinstance(self.database, PackedDatabase):
+            return self.database.subject_length(subject_index)
+        return len(self.database[subject_index])
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def __getitem__(self, window):
+        cached = self._cached
+        if cached[0] != window:
+            subject_index = self.subjects[window]
+            begin = self.begins[window]
+            end = self.owned[window] + self.size + self.overlap
+            if isinstance(self.database, PackedDatabase):
+                seq = self.database.decode(subject_index, begin, end)
+            else:
+                seq = self.database[subject_index][begin:end]
+            cached = (window, seq)
+            self._cached = cached
+        return cached[1]
+
+    def __iter__(self):
+        for window in range(len(self)):
+            yield self[window]
+
+    def owns(self, window, pos):
+        # whether the subject position pos lies in the window's owned region
+        return 0 <= pos - self.owned[window] < self.size
+
+    def remap(self, results):
+        # Hits on windows as hits on whole subjects, each from the window
+        # owning its seed. Results arrive window by window, so each
+        # subject's hits are buffered and put back in the (strand, query
+        # position, subject position) order of an unwindowed search.
+        subject_index = None
+        pending = []
+        for res in results:
+            window = res.subject_index
+            begin = self.begins[window]
+            if not self.owns(window, begin + res.subject_pos):
+                continue
+            if self.subjects[window] != subject_index:
+                yield from sorted(pending, key=search_order)
+                subject_index = self.subjects[window]
+                pending = []
+            res.subject_index = subject_index
+            res.s_start += begin
+            res.subject_pos += begin
+            pending.append(res)
+        yield from sorted(pending, key=search_order)
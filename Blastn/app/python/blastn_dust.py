@@ -0,0 +1,91 @@
+# blastn low-complexity masking
+#
+# DUST-style masker: each window of WINDOW bases is scored from the
+# counts of its overlapping base triplets, sum(c * (c - 1) / 2) / (l - 1)
+# for l triplets, so repeats such as poly-A runs score far above random
+# sequence. In every window scoring above level, the bases of triplets
+# occurring more than once in the window are masked, which leaves the
+# unique flanks of a repeat open to seeding. Counts are updated as the
+# window slides, so a sequence is masked in one pass.
+#
+# The mask is an int64 array of masked runs, start, end, start, end, ...
+# in increasing order, which stays small next to the sequence and is
+# computed once per subject (SubjectMasks, or the .dm file blastn_index
+# keeps next to the database). Seeding skips words that touch a masked
+# base.
+from array import array
+
+WINDOW = 64
+LEVEL = 20
+
+_triplet_code = {a + b + c: (i * 4 + j) * 4 + k
+                 for i, a in enumerate("ACGT")
+                 for j, b in enumerate("ACGT")
+                 for k, c in enumerate("ACGT")}
+
+
+def dust_runs(seq, level=LEVEL, window=WINDOW):
+    # [start, end) runs of the masked bases of seq, flattened
+    triplets = [_triplet_code.get(seq[i:i + 3], -1) for i in range(len(seq) - 2)]
+    span = min(window, len(seq)) - 2  # triplets per window
+    runs = array("q")
+    if span < 2:
+        return runs
+    counts = [0] * 64
+    score = 0
+    checked = 0  # triplets before this one are already decided
+    for i, t in enumerate(triplets):
+        if t >= 0:
+            score += counts[t]
+            counts[t] += 1
+        if i >= span:
+            old = triplets[i - span]
+            if old >= 0:
+                counts[old] -= 1
+                score -= counts[old]
+        if i >= span - 1 and score > level * (span - 1):
+            # the window holds triplets i - span + 1 .. i
+            for j in range(max(i - span + 1, checked), i + 1):
+                if triplets[j] >= 0 and counts[triplets[j]] > 1:
+                    # triplets are masked in increasing order, so a run
+                    # either grows or a new one starts
+                    if runs and j <= runs[-1]:
+                        runs[-1] = j + 3
+                    else:
+                        runs.extend((j, j + 3))
+            checked = i + 1
+    return runs
+
+
+def unmasked(codes, runs, k):
+    # the (pos, code) pairs, in increasing pos, of words clear of the runs
+    if not runs:
+        yield from codes
+        return
+    r = 0
+    n = len(runs)
+    for pos, code in codes:
+        while r < n and runs[r + 1] <= pos:
+            r += 2
+        if r == n or runs[r] >= pos + k:
+            yield pos, code
+
+
+class SubjectMasks:
+    # Masked runs of every subject of a database, each computed the first
+    # time it is asked for; indexes like the masks file blastn_index maps.
+
+    def __init__(self, database, level):
+        self.database = database
+        self.level = level
+        self._runs = {}
+
+    def __len__(self):
+        return len(self.database)
+
+    def __getitem__(self, subject_index):
+        runs = self._runs.get(subject_index)
+        if runs is None:
+            runs = dust_runs(self.database[subject_index], self.level)
+            self._runs[subject_index] = runs
+        return runs
@@ -0,0 +1,66 @@
+# blastn exact matches
+#
+# Fast path for queries that occur verbatim in a subject: the database is
+# searched for the whole query with the C substring search of str.find
+# (text databases) or mmap.find (packed databases) instead of seeding and
+# extending word by word.
+#
+# In a packed database a subject starts on a byte boundary and a byte
+# holds 4 bases, so an occurrence at base p packs the query starting at
+# bit pair p % 4 of a byte. For each of the 4 phases the bytes the query
+# covers in full are searched for; every find is then checked against
+# the whole query.
+from blastn_packed import PackedDatabase, encode_codes
+
+
+def pack_whole_bytes(codes):
+    # 4 codes per byte, base j in bits [2j+1:2j]; len(codes) % 4 == 0
+    return bytes(a | (b << 2) | (c << 4) | (d << 6)
+                 for a, b, c, d in zip(codes[0::4], codes[1::4], codes[2::4], codes[3::4]))
+
+
+def find_text(database, query, subject_range):
+    # (subject, position) of every occurrence, in subject order
+    for subject_index in subject_range:
+        subject = database[subject_index]
+        pos = subject.find(query)
+        while pos >= 0:
+            yield subject_index, pos
+            pos = subject.find(query, pos + 1)
+
+
+def find_packed(database, query, subject_range):
+    # the same over the packed bytes of subject_range
+    try:
+        codes = encode_codes(query)
+    except ValueError:
+        return  # the packed database only holds A/C/G/T
+    if len(codes) < 7:
+        # too short for a whole packed byte in every phase
+        yield from find_text(database, query, subject_range)
+        return
+    if not subject_range:
+        return
+    start = database.packed_range(subject_range[0])[0]
+    offset, nbytes = database.packed_range(subject_range[-1])
+    end = offset + nbytes
+    found = set()
+    for phase in range(4):
+        skip = -phase % 4  # query bases before the first whole byte
+        n_bytes = (len(codes) - skip) // 4
+        pattern = pack_whole_bytes(codes[skip:skip + 4 * n_bytes])
+        at = database.find(pattern, start, end)
+        while at >= 0:
+            subject_index = database.subject_at(at)
+            pos = (at - database.packed_range(subject_index)[0]) * 4 - skip
+            if (0 <= pos <= database.subject_length(subject_index) - len(codes)
+                    and database.decode(subject_index, pos, pos + len(codes)) == query):
+                found.add((subject_index, pos))
+            at = database.find(pattern, at + 1, end)
+    yield from sorted(found)
+
+
+def find(database, query, subject_range):
+    if isinstance(database, PackedDatabase):
+        return find_packed(database, query, subject_range)
+    return find_text(database, query, subject_range)
@@ -0,0 +1,223 @@
+# blastn index cache
+#
+# Build-once store for blastn.py, in the spirit of makeblastdb. Next to a
+# database file we keep a packed copy of the sequence (blastn_packed) and
+# the CSR k-mer lookup table, both named after the database's content
+# hash so an edited database is never matched with a stale index:
+#
+#   <db>.<hash>.stamp     size and modification time the hash was taken at
+#   <db>.<hash>.pk        packed sequence (text databases only)
+#   <db>.<hash>.nopk      marks a database with bases the packed format
+#                         cannot hold, so packing is not retried
+#   <db>.<hash>.k<k>.idx  k-mer index for word size k
+#   <db>.<hash>.s<seed>.idx  index for a spaced-seed template
+#   <db>.<hash>.k<k>.w<w>.idx  index of the (w,k)-minimizers only
+#   <db>.<hash>.k<k>.c<n>-<o>.idx  index of n-base subject windows with o
+#                                  bases of overlap (blastn_chunk)
+#   <db>.<hash>.sa        suffix array (blastn_sa), any word size
+#   <db>.<hash>.k<k>.b<bits>.bf  per-subject Bloom filters (blastn_bloom)
+#   <db>.<hash>[.c<n>-<o>].d<level>.dm  DUST-masked runs of every searched
+#                                       subject (blastn_dust)
+#
+# An index built with DUST masking adds .d<level> before .idx or .sa.
+#
+# Index layout (little-endian): header magic b"BLNI", uint32 version,
+# uint32 k, 4 pad bytes, uint64 table size, uint64 entries, then int64
+# arrays offsets (table size + 1), subjects (entries) and positions
+# (entries). Masks share the header with magic b"BLND" and the DUST level
+# in place of k, then int64 offsets (subjects + 1) into the int64 runs.
+import glob
+import hashlib
+import mmap
+import os
+import re
+import struct
+from array import array
+
+MAGIC = b"BLNI"
+VERSION = 1
+HEADER = struct.Struct("<4sII4xQQ")
+MASKS_MAGIC = b"BLND"
+
+# the cache file names after "<db>.": a content hash stamp, then what
+# index_name(), cache_paths(), suffix_array_path(), filter_path() and
+# mask_path() append
+INDEX_NAME = r"(?:k\d+|s[01]+)(?:\.w\d+)?(?:\.c\d+-\d+)?(?:\.d\d+)?"
+CACHE_NAME = re.compile(r"([0-9a-f]{16})\.(?:stamp|pk|nopk|(?:d\d+\.)?sa|"
+                        r"(?:c\d+-\d+\.)?d\d+\.dm|"
+                        + INDEX_NAME + r"\.(?:idx|b\d+\.bf))")
+
+
+def content_hash(path):
+    # Hashing reads the whole database, so the digest is remembered in a
+    # stamp file with the size and modification time it was taken at and
+    # reused while both still match.
+    info = os.stat(path)
+    stamp = f"{info.st_size} {info.st_mtime_ns}\n"
+    for candidate in glob.glob(glob.escape(path) + ".*.stamp"):
+        match = CACHE_NAME.fullmatch(candidate[len(path) + 1:])
+        if not match:
+            continue
+        try:
+            with open(candidate, "r") as file:
+                if file.read() == stamp:
+                    return match.group(1)
+        except OSError:
+            pass
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()[:16]
+    try:
+        write_atomic(stamp_path(path, digest), lambda tmp: write_text(tmp, stamp))
+    except OSError:
+        pass  # read-only location: hash again next time
+    return digest
+
+
+def stamp_path(db_path, digest):
+    return f"{db_path}.{digest}.stamp"
+
+
+def no_pack_path(db_path, digest):
+    return f"{db_path}.{digest}.nopk"
+
+
+def index_name(k, seed=None, dust=0, minimizer=0, chunk=None):
+    # chunk is (window size, overlap) for an index of subject windows
+    name = f"k{k}" if seed is None else f"s{seed}"
+    if minimizer:
+        name += f".w{minimizer}"
+    if chunk:
+        name += ".c{}-{}".format(*chunk)
+    if dust:
+        name += f".d{dust}"
+    return name
+
+
+def cache_paths(db_path, digest, k, seed=None, dust=0, minimizer=0, chunk=None):
+    base = f"{db_path}.{digest}"
+    return base + ".pk", f"{base}.{index_name(k, seed, dust, minimizer, chunk)}.idx"
+
+
+def filter_path(db_path, digest, bits, k, seed=None, dust=0, minimizer=0, chunk=None):
+    # the filters hold the words the index holds
+    return f"{db_path}.{digest}.{index_name(k, seed, dust, minimizer, chunk)}.b{bits}.bf"
+
+
+def suffix_array_path(db_path, digest, dust=0):
+    return f"{db_path}.{digest}" + (f".d{dust}" if dust else "") + ".sa"
+
+
+def mask_path(db_path, digest, dust, chunk=None):
+    # masks follow the searched subjects, so windows have their own
+    window = ".c{}-{}".format(*chunk) if chunk else ""
+    return f"{db_path}.{digest}{window}.d{dust}.dm"
+
+
+def remove_stale(db_path, digest):
+    # Drop cache files left over from earlier contents of the database.
+    # Only names the cache itself writes are touched, so files of other
+    # databases sharing the prefix (db and db.txt) and the user's own
+    # files are left alone.
+    for path in glob.glob(glob.escape(db_path) + ".*"):
+        match = CACHE_NAME.fullmatch(path[len(db_path) + 1:])
+        if match and match.group(1) != digest:
+            os.remove(path)
+
+
+def write_atomic(path, write):
+    # write(tmp_path) fills a temporary file that replaces path on success
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        result = write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return result
+
+
+def write_text(path, text):
+    with open(path, "w") as out:
+        out.write(text)
+
+
+def write_index(path, k, offsets, subjects, positions):
+    def write(tmp):
+        with open(tmp, "wb") as out:
+            out.write(HEADER.pack(MAGIC, VERSION, k, len(offsets) - 1, len(subjects)))
+            for values in (offsets, subjects, positions):
+                array("q", values).tofile(out)
+    write_atomic(path, write)
+
+
+def write_masks(path, dust, masks):
+    # masks yields the runs of every subject in order
+    offsets = array("q", [0])
+    runs = array("q")
+    for subject_runs in masks:
+        runs.extend(subject_runs)
+        offsets.append(len(runs))
+
+    def write(tmp):
+        with open(tmp, "wb") as out:
+            out.write(HEADER.pack(MASKS_MAGIC, VERSION, dust, len(offsets) - 1, len(runs)))
+            offsets.tofile(out)
+            runs.tofile(out)
+    write_atomic(path, write)
+
+
+class MappedIndex:
+    # Memory-mapped k-mer index; offsets, subjects and positions are
+    # zero-copy int64 views that index like the arrays build_index makes.
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap)
+        magic, version, self.k, table_size, n = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a blastn index")
+        words = self.buffer[HEADER.size:].cast("q")
+        self.offsets = words[:table_size + 1]
+        self.subjects = words[table_size + 1:table_size + 1 + n]
+        self.positions = words[table_size + 1 + n:table_size + 1 + 2 * n]
+        self._words = words
+
+    def close(self):
+        for view in (self.offsets, self.subjects, self.positions, self._words, self.buffer):
+            view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+class MappedMasks:
+    # Memory-mapped DUST masks; masks[i] is a zero-copy int64 view of the
+    # runs of subject i, as blastn_dust.SubjectMasks gives them.
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap)
+        magic, version, self.dust, n_subjects, n = HEADER.unpack_from(self.buffer, 0)
+        if magic != MASKS_MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a blastn mask file")
+        words = self.buffer[HEADER.size:].cast("q")
+        self.offsets = words[:n_subjects + 1]
+        self.runs = words[n_subjects + 1:n_subjects + 1 + n]
+        self._words = words
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, subject_index):
+        return self.runs[self.offsets[subject_index]:self.offsets[subject_index + 1]]
+
+    def close(self):
+        for view in (self.offsets, self.runs, self._words, self.buffer):
+            view.release()
+        self._mmap.close()
+        self._file.close()
@@ -0,0 +1,56 @@
+# blastn minimizer sampling
+#
+# (w,k)-minimizers for a low-memory index: of every w consecutive words
+# of a sequence only the one with the smallest hash (the leftmost on
+# ties) is indexed, about 2/(w+1) of the words of random sequence. The
+# query is sampled the same way, so an exact match of at least w + k - 1
+# bases still shares an indexed word with it; shorter matches may be
+# missed. w therefore trades index memory against sensitivity, and w = 1
+# keeps every word.
+#
+# Words are ranked by an invertible mix of their code rather than by the
+# code itself, so low-complexity words such as AAAA are not always the
+# minimizer.
+from collections import deque
+
+WINDOW = 10
+
+
+def word_hash(code, bits):
+    # the odd multiplier and the xor-shift are both invertible modulo 2**bits
+    h = (code * 0x9E3779B97F4A7C15) & ((1 << bits) - 1)
+    return h ^ (h >> (bits // 2))
+
+
+def minimizers(codes, w, bits, n):
+    # The (pos, code) pairs of codes (in position order, bits-bit codes)
+    # that are the minimizer of some window of w word positions out of
+    # the n of the sequence. A sequence of fewer than w words is one
+    # window. Positions missing from codes (non-ACGT or masked words)
+    # are gaps the windows slide over.
+    w = min(w, n)
+    window = deque()  # (hash, pos, code), hashes increasing
+    kept = -1
+    end = w - 1  # last position of the next window to report
+    for pos, code in _with_end(codes, n):
+        while end < pos and window:
+            while window and window[0][1] <= end - w:
+                window.popleft()
+            if not window:
+                break
+            if window[0][1] != kept:
+                kept = window[0][1]
+                yield kept, window[0][2]
+            end += 1
+        if code is None:
+            return
+        h = word_hash(code, bits)
+        while window and window[-1][0] > h:
+            window.pop()
+        window.append((h, pos, code))
+        end = max(end, pos)
+
+
+def _with_end(codes, n):
+    yield from codes
+    yield n, None
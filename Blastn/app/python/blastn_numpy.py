@@ -0,0 +1,229 @@
+# blastn numpy engine
+#
+# Batched ungapped extension for blastn.py. A batch of HSPs is given as
+# arrays of (subject base offset, subject length, query offset, subject
+# offset) into one concatenated subject buffer. Every HSP's diagonal is
+# laid out as a row of a (batch x steps) matrix, so scoring, the running
+# maximum and the X-drop cut points are a handful of whole-array
+# operations per tile of steps. The results are identical to
+# ungapped_extend().
+import numpy as np
+
+# columns (steps) of the first tile and the widest tile of extend_batch
+TILE = 16
+MAX_TILE = 512
+
+
+def codes(seq):
+    # raw characters as uint8 so comparisons match the scalar str compare
+    return np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+
+
+def _deltas(query_codes, db_codes, q_idx, d_idx, valid):
+    match = query_codes[np.where(valid, q_idx, 0)] == db_codes[np.where(valid, d_idx, 0)]
+    return np.where(valid, np.where(match, 1, -3), 0)
+
+
+def extend_batch(query_codes, db_codes, subject_base, subject_len,
+                 q_offs, s_offs, kmer, xdrop, seed_scores=None, stats=None):
+    # Each row starts from its seed score (kmer unless seed_scores gives
+    # spaced-seed scores). Step t of a row scores one base on each side
+    # that is still in bounds, like the lockstep scalar walk. The walk
+    # stops at the first step whose score is more than xdrop below the
+    # running maximum, and the result is trimmed to the last step
+    # reaching that maximum.
+    #
+    # Steps are taken a tile of columns at a time, over the rows still
+    # walking, so the work follows how far the extensions actually go.
+    # Tiles start narrow, since most walks stop within a few steps, and
+    # widen for the rows that keep going.
+    subject_base = np.asarray(subject_base, dtype=np.int64)
+    subject_len = np.asarray(subject_len, dtype=np.int64)
+    q_offs = np.asarray(q_offs, dtype=np.int64)
+    s_offs = np.asarray(s_offs, dtype=np.int64)
+    n = len(q_offs)
+
+    left_len = np.minimum(q_offs, s_offs)
+    right_len = np.minimum(len(query_codes) - q_offs - kmer, subject_len - s_offs - kmer)
+    n_steps = np.maximum(left_len, right_len)
+    start = np.full(n, kmer, dtype=np.int64)
+    if seed_scores is not None:
+        start = np.asarray(seed_scores, dtype=np.int64)
+    score = start.copy()     # score after the steps taken so far
+    run_max = start.copy()   # best score so far
+    best = np.zeros(n, dtype=np.int64)  # last step reaching run_max
+    stopped = np.zeros(n, dtype=bool)
+
+    active = np.flatnonzero(n_steps > 0)
+    t0 = 0
+    tile = TILE
+    while len(active):
+        t = np.arange(t0 + 1, t0 + tile + 1, dtype=np.int64)[None, :]
+        a_left = left_len[active][:, None]
+        a_right = right_len[active][:, None]
+        q = q_offs[active][:, None]
+        d = subject_base[active][:, None] + s_offs[active][:, None]
+        left_valid = t <= a_left
+        right_valid = t <= a_right
+        delta = _deltas(query_codes, db_codes, q - t, d - t, left_valid)
+        delta += _deltas(query_codes, db_codes, q + kmer - 1 + t, d + kmer - 1 + t,
+                         right_valid)
+
+        cum = np.cumsum(delta, axis=1) + score[active][:, None]
+        tile_max = np.maximum(np.maximum.accumulate(cum, axis=1), run_max[active][:, None])
+        valid = left_valid | right_valid
+        dropped = (tile_max - cum > xdrop) & valid
+        drops = dropped.any(axis=1)
+        first = np.where(drops, dropped.argmax(axis=1), tile)
+
+        # steps taken: in bounds and before the step the X-drop stops at
+        taken = valid & (np.arange(tile)[None, :] < first[:, None])
+        at_max = taken & (cum == tile_max)
+        reached = at_max.any(axis=1)
+        last = tile - 1 - np.argmax(at_max[:, ::-1], axis=1)
+        best[active] = np.where(reached, t0 + 1 + last, best[active])
+        rows = np.arange(len(active))
+        run_max[active] = tile_max[rows, np.minimum(first, tile - 1)]
+        score[active] = cum[:, -1]
+
+        stopped[active] = drops
+        n_steps[active] = np.where(drops, t0 + first, n_steps[active])
+        t0 += tile
+        active = active[~drops & (n_steps[active] > t0)]
+        tile = min(tile * 2, MAX_TILE)
+
+    if stats is not None:
+        # the step the X-drop stops at is compared but not taken
+        seen = n_steps + stopped
+        stats["bases_compared"] += int((np.minimum(seen, left_len)
+                                        + np.minimum(seen, right_len)).sum())
+        stats["xdrop_terminations"] += int(stopped.sum())
+
+    n_left = np.minimum(best, left_len)
+    n_right = np.minimum(best, right_len)
+    return run_max, q_offs - n_left, q_offs + kmer + n_right, s_offs - n_left
+
+
+# Banded gapped extension. The DP runs over anti-diagonals d = i + j of
+# the (query, subject) matrix, where all cells depend only on the two
+# previous anti-diagonals, so each anti-diagonal is one vector step. Only
+# cells within band of the anchor diagonal are computed, which keeps the
+# cost at O(band * length). Gaps are affine: a gap of length L scores
+# gap_open + L * gap_extend.
+
+NEG = -(1 << 40)
+
+
+def _gapped_one_side(q, t, band, xdrop, match, mismatch, gap_open, gap_extend):
+    # Extend from cell (0, 0) towards the ends of q and t. Returns the best
+    # score, the query/subject lengths it covers and the edit operations:
+    # "M" aligned pair, "Q" query base against a gap, "S" subject base
+    # against a gap.
+    n, m = len(q), len(t)
+    if n == 0 or m == 0:
+        # a pure gap never scores above the empty extension
+        return 0, 0, 0, []
+    # buffers are indexed by query position i + 1; slot 0 stays NEG
+    H = [np.full(n + 2, NEG, dtype=np.int64) for _ in range(3)]
+    E = [np.full(n + 2, NEG, dtype=np.int64) for _ in range(3)]
+    F = [np.full(n + 2, NEG, dtype=np.int64) for _ in range(3)]
+    written = [None, None, None]
+    H[0][1] = 0
+    written[0] = (0, 0)
+    best, best_i, best_j = 0, 0, 0
+    traceback = [None]
+    alive_prev = True
+
+    for d in range(1, n + m + 1):
+        lo = max(0, d - m, (d - band + 1) // 2)
+        hi = min(n, d, (d + band) // 2)
+        cur, p1, p2 = d % 3, (d - 1) % 3, (d - 2) % 3
+        if written[cur] is not None:
+            a, b = written[cur]
+            H[cur][a + 1:b + 2] = NEG
+            E[cur][a + 1:b + 2] = NEG
+            F[cur][a + 1:b + 2] = NEG
+            written[cur] = None
+        if lo > hi:
+            # narrow bands skip every other anti-diagonal
+            traceback.append(None)
+            if not alive_prev:
+                break
+            alive_prev = False
+            continue
+        written[cur] = (lo, hi)
+
+        i = np.arange(lo, hi + 1)
+        j = d - i
+        here = slice(lo + 1, hi + 2)
+        up = slice(lo, hi + 1)
+
+        sub = np.where(q[np.maximum(i - 1, 0)] == t[np.maximum(j - 1, 0)], match, mismatch)
+        diag = np.where((i >= 1) & (j >= 1), H[p2][up] + sub, NEG)
+
+        e_open = H[p1][here] + gap_open + gap_extend
+        e_ext = E[p1][here] + gap_extend
+        e_src = e_ext > e_open
+        e = np.maximum(e_open, e_ext)
+
+        f_open = H[p1][up] + gap_open + gap_extend
+        f_ext = F[p1][up] + gap_extend
+        f_src = f_ext > f_open
+        f = np.maximum(f_open, f_ext)
+
+        h = np.maximum(diag, np.maximum(e, f))
+        h_src = np.where(h == diag, 0, np.where(h == e, 1, 2))
+
+        dead = h < best - xdrop
+        h[dead] = NEG
+        e[dead] = NEG
+        f[dead] = NEG
+        H[cur][here] = h
+        E[cur][here] = e
+        F[cur][here] = f
+        traceback.append((lo, h_src.astype(np.uint8), e_src, f_src))
+
+        k = int(h.argmax())
+        if h[k] > best:
+            best, best_i, best_j = int(h[k]), lo + k, d - lo - k
+        alive = not dead.all()
+        if not alive and not alive_prev:
+            break
+        alive_prev = alive
+
+    ops = []
+    i, j, state = best_i, best_j, 0
+    while i > 0 or j > 0:
+        lo, h_src, e_src, f_src = traceback[i + j]
+        k = i - lo
+        if state == 0:
+            state = int(h_src[k])
+            if state == 0:
+                ops.append("M")
+                i -= 1
+                j -= 1
+        elif state == 1:
+            ops.append("S")
+            state = 1 if e_src[k] else 0
+            j -= 1
+        else:
+            ops.append("Q")
+            state = 2 if f_src[k] else 0
+            i -= 1
+    ops.reverse()
+    return best, best_i, best_j, ops
+
+
+def banded_gapped_extend(query_codes, subject_codes, q_anchor, s_anchor, band, xdrop,
+                         match=1, mismatch=-3, gap_open=-5, gap_extend=-2):
+    # Gapped X-drop extension in both directions from an anchor pair.
+    # Returns (score, q_start, q_end, s_start, s_end, ops) with ops running
+    # left to right over the aligned region.
+    params = (band, xdrop, match, mismatch, gap_open, gap_extend)
+    r_score, r_i, r_j, r_ops = _gapped_one_side(
+        query_codes[q_anchor:], subject_codes[s_anchor:], *params)
+    l_score, l_i, l_j, l_ops = _gapped_one_side(
+        query_codes[:q_anchor][::-1], subject_codes[:s_anchor][::-1], *params)
+    ops = l_ops[::-1] + r_ops
+    return (l_score + r_score, q_anchor - l_i, q_anchor + r_i,
+            s_anchor - l_j, s_anchor + r_j, ops)
@@ -0,0 +1,165 @@
+# blastn packed database
+#
+# 2-bit packed, memory-mapped database format for blastn.py. Bases use
+# the same encoding as the accelerator (A=0, C=1, G=2, T=3) and the same
+# bit order as unpack_data: base j of a byte sits in bits [2j+1:2j], so
+# every aligned 32-bit little-endian word holds 16 bases exactly as the
+# xcel reads them from memory.
+#
+# File layout (little-endian):
+#   header  : magic b"BLNP", uint32 version, uint64 n_subjects
+#   table   : n_subjects x (uint64 byte_offset, uint64 n_bases)
+#   data    : packed bases, each subject padded to a 16-base word
+import mmap
+import os
+import struct
+from bisect import bisect_right
+
+MAGIC = b"BLNP"
+VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+ENTRY = struct.Struct("<QQ")
+WORD_BASES = 16
+WORD_BYTES = 4
+
+BASES = "ACGT"
+_to_code = bytes.maketrans(b"ACGT", b"\x00\x01\x02\x03")
+_byte_bases = ["".join(BASES[(b >> (2 * j)) & 0x3] for j in range(4)) for b in range(256)]
+
+
+def encode_codes(seq):
+    # one 2-bit code per byte; raises on bases the format cannot hold
+    codes = seq.encode("ascii").translate(_to_code)
+    if codes and max(codes) > 3:
+        raise ValueError("packed database only holds A/C/G/T bases")
+    return codes
+
+
+def pack_codes(codes):
+    pad = -len(codes) % WORD_BASES
+    codes = codes + bytes(pad)
+    return bytes(a | (b << 2) | (c << 4) | (d << 6)
+                 for a, b, c, d in zip(codes[0::4], codes[1::4], codes[2::4], codes[3::4]))
+
+
+def decode_packed(packed, n):
+    # the first n bases of packed bytes
+    return "".join(map(_byte_bases.__getitem__, packed))[:n]
+
+
+def is_packed(path):
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def pack_database(text_path, out_path):
+    # two streaming passes so the text database is never held in memory
+    lengths = []
+    with open(text_path, "r") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                lengths.append(len(line))
+
+    data_start = HEADER.size + ENTRY.size * len(lengths)
+    data_start += -data_start % WORD_BYTES
+    with open(out_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len(lengths)))
+        offset = data_start
+        for n in lengths:
+            out.write(ENTRY.pack(offset, n))
+            offset += (n + WORD_BASES - 1) // WORD_BASES * WORD_BYTES
+        out.write(bytes(data_start - out.tell()))
+        with open(text_path, "r") as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    out.write(pack_codes(encode_codes(line)))
+    return len(lengths)
+
+
+class PackedDatabase:
+    # Read-only view over a packed database file. Indexing returns the
+    # decoded subject string; the most recent subject is cached because
+    # the search walks hits in subject order.
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap)
+        magic, version, n = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a packed blastn database")
+        self.n_subjects = n
+        self._table = self.buffer[HEADER.size:HEADER.size + ENTRY.size * n].cast("Q")
+        self._cached = (None, None)
+
+    def __len__(self):
+        return self.n_subjects
+
+    def __getitem__(self, subject_index):
+        # (index, subject) is swapped in as one tuple so threads sharing the
+        # database never see a mismatched pair
+        cached = self._cached
+        if cached[0] != subject_index:
+            cached = (subject_index, self.decode(subject_index))
+            self._cached = cached
+        return cached[1]
+
+    def __iter__(self):
+        for i in range(self.n_subjects):
+            yield self[i]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def subject_length(self, subject_index):
+        return self._table[2 * subject_index + 1]
+
+    def packed_range(self, subject_index):
+        # (byte offset, byte length) of the subject's packed bases, word padded
+        offset = self._table[2 * subject_index]
+        n = self._table[2 * subject_index + 1]
+        return offset, (n + WORD_BASES - 1) // WORD_BASES * WORD_BYTES
+
+    def packed(self, subject_index):
+        # zero-copy slice of the subject's packed bytes, word padded
+        offset, nbytes = self.packed_range(subject_index)
+        return self.buffer[offset:offset + nbytes]
+
+    def subject_at(self, byte_offset):
+        # the subject whose packed bytes hold byte_offset
+        return bisect_right(self._table[0::2], byte_offset) - 1
+
+    def find(self, pattern, start, end):
+        # lowest byte offset of pattern within [start, end) of the file, or -1
+        return self._mmap.find(pattern, start, end)
+
+    def read(self, lo, hi):
+        # packed bytes of subjects lo..hi-1 as one buffer, read with pread
+        # instead of faulting in the mapping so a reader thread waits on
+        # the storage without holding the GIL; subject i starts at byte
+        # packed_range(i)[0] - packed_range(lo)[0]
+        start = self.packed_range(lo)[0]
+        offset, nbytes = self.packed_range(hi - 1)
+        return os.pread(self._file.fileno(), offset + nbytes - start, start)
+
+    def decode(self, subject_index, start=0, end=None):
+        # bases start..end of the subject; only their bytes are decoded
+        n = self.subject_length(subject_index)
+        end = n if end is None else min(end, n)
+        if start >= end:
+            return ""
+        data = self.packed(subject_index)[start // 4:(end + 3) // 4]
+        skip = start % 4
+        return decode_packed(data, skip + end - start)[skip:]
+
+    def close(self):
+        self._table.release()
+        self.buffer.release()
+        self._mmap.close()
+        self._file.close()
@@ -0,0 +1,103 @@
+# blastn prefetch
+#
+# Sequential scans over a packed database (building the index, batch
+# searches) otherwise stall on storage between subjects: each subject is
+# faulted into the mapping as it is reached, and on network storage a
+# cold page costs a round trip. Instead a reader thread fetches the next
+# blocks of subjects with pread, which waits without holding the GIL,
+# and decodes them into a bounded queue while the current block is being
+# searched. A block is one read into one buffer of consecutive subjects,
+# so subjects left out of a scan (ruled out by Bloom filters) are never
+# read; the decoded subjects go through the queue as they are, nothing
+# is copied on the way.
+#
+# Text databases are already in memory and are scanned directly.
+import queue
+import threading
+
+from blastn_packed import PackedDatabase, decode_packed
+
+# bytes of packed bases per read, and blocks decoded ahead of the scan
+BLOCK_BYTES = 1 << 20
+DEPTH = 2
+
+
+def blocks(database, subject_indices):
+    # runs of consecutive subjects of the (ascending) subject_indices
+    # spanning about BLOCK_BYTES of the file each
+    block = []
+    start = None
+    for subject_index in subject_indices:
+        if block and subject_index != block[-1] + 1:
+            yield block
+            block = []
+            start = None
+        offset, nbytes = database.packed_range(subject_index)
+        if start is None:
+            start = offset
+        block.append(subject_index)
+        if offset + nbytes - start >= BLOCK_BYTES:
+            yield block
+            block = []
+            start = None
+    if block:
+        yield block
+
+
+def read_ahead(database, subject_indices, out, stop):
+    # reader thread: decoded blocks into out, then None; an error is
+    # handed to the scan to raise
+    try:
+        for block in blocks(database, subject_indices):
+            data = memoryview(database.read(block[0], block[-1] + 1))
+            base = database.packed_range(block[0])[0]
+            decoded = []
+            for subject_index in block:
+                offset, nbytes = database.packed_range(subject_index)
+                decoded.append((subject_index, decode_packed(
+                    data[offset - base:offset - base + nbytes],
+                    database.subject_length(subject_index))))
+            if not put(out, decoded, stop):
+                return
+    except Exception as e:
+        put(out, e, stop)
+        return
+    put(out, None, stop)
+
+
+def put(out, item, stop):
+    # False once the scan has stopped listening
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def subjects(database, subject_indices=None):
+    # (subject index, bases) of the subjects of subject_indices (in
+    # ascending order), or of every subject
+    if subject_indices is None:
+        subject_indices = range(len(database))
+    if not isinstance(database, PackedDatabase) or len(subject_indices) < 2:
+        for subject_index in subject_indices:
+            yield subject_index, database[subject_index]
+        return
+    out = queue.Queue(DEPTH)
+    stop = threading.Event()
+    reader = threading.Thread(target=read_ahead, args=(database, subject_indices, out, stop),
+                              daemon=True)
+    reader.start()
+    try:
+        while True:
+            block = out.get()
+            if block is None:
+                return
+            if isinstance(block, Exception):
+                raise block
+            yield from block
+    finally:
+        stop.set()
+        reader.join()
@@ -0,0 +1,79 @@
+# blastn profiling
+#
+# Opt-in per-stage timers and counters for blastn.py, for tuning k and
+# the thresholds and for comparing against the accelerator sims' cycle
+# counts. Stages of the generator pipeline run interleaved, so time is
+# charged to whichever stage is running: every switch into or out of a
+# stage closes the previous stage's interval, and each stage's time
+# excludes the stages it pulls from. NullProfile stands in when nothing
+# is profiled, so the pipeline is built the same way either way.
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+
+COUNTERS = ("words", "seed_hits", "extensions", "bases_compared",
+            "xdrop_terminations", "results")
+
+
+class Profile:
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.counts = Counter({name: 0 for name in COUNTERS})
+        self.current = None
+        self.mark = time.perf_counter()
+        self.start = self.mark
+
+    def switch(self, stage):
+        # charge the time since the last switch to the running stage
+        now = time.perf_counter()
+        if self.current is not None:
+            self.times[self.current] += now - self.mark
+        previous, self.current, self.mark = self.current, stage, now
+        return previous
+
+    @contextmanager
+    def stage(self, stage):
+        previous = self.switch(stage)
+        try:
+            yield
+        finally:
+            self.switch(previous)
+
+    def timed(self, stage, items, counter=None):
+        # pass items through, charging the time spent producing them to
+        # stage and counting them under counter
+        items = iter(items)
+        while True:
+            previous = self.switch(stage)
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                self.switch(previous)
+            if counter is not None:
+                self.counts[counter] += 1
+            yield item
+
+    def report(self):
+        return {"seconds": dict(self.times),
+                "total_seconds": time.perf_counter() - self.start,
+                "counters": dict(self.counts)}
+
+    def dump(self, file):
+        json.dump(self.report(), file, indent=2)
+        file.write("\n")
+
+
+class NullProfile:
+    # no timers, and counts is None so the stages skip their counters
+
+    counts = None
+
+    def stage(self, stage):
+        return nullcontext()
+
+    def timed(self, stage, items, counter=None):
+        return items
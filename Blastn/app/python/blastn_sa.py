@@ -0,0 +1,257 @@
+# blastn suffix array
+#
+# Alternative to the k-mer index for blastn.py: a suffix array over the
+# whole database, in which the occurrences of a word of any length are
+# one contiguous interval found by binary search. One file therefore
+# serves every word size, where the k-mer index is rebuilt per k.
+#
+# The text is the database as 2-bit codes, one per byte, with byte 4
+# closing every subject and standing in for non-ACGT (or masked) bases,
+# so no word match crosses a subject boundary or a masked base.
+#
+# Maximal exact matches need no comparison in the subjects: extending a
+# match by one base narrows its interval to the suffixes that extend it
+# too, and the suffixes left behind are the matches ending there.
+#
+# File layout (little-endian): header magic b"BLNS", uint32 version,
+# uint64 n_subjects, uint64 text length, then int64 subject starts
+# (n_subjects + 1), int64 suffix array (text length) and the text bytes.
+import mmap
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+
+MAGIC = b"BLNS"
+VERSION = 1
+HEADER = struct.Struct("<4sIQQ")
+STOP = 4
+
+_to_code = bytes.maketrans(b"ACGT", b"\x00\x01\x02\x03")
+_stop_others = bytes(b if b < 4 else STOP for b in range(256))
+_shift_up = bytes(min(b + 1, 255) for b in range(256))
+# query bases the text cannot match, not even its STOP bytes
+_unmatched_others = bytes(b if b < 4 else STOP + 1 for b in range(256))
+
+
+def text_codes(seq, runs=()):
+    # one code byte per base; non-ACGT bases and the masked runs
+    # (blastn_dust) become STOP
+    codes = bytearray(seq.encode("ascii").translate(_to_code).translate(_stop_others))
+    for i in range(0, len(runs), 2):
+        start, end = runs[i], runs[i + 1]
+        codes[start:end] = bytes([STOP]) * (end - start)
+    return codes
+
+
+def query_codes(seq):
+    # code bytes of a query; non-ACGT bases match nothing in the text
+    return seq.encode("ascii").translate(_to_code).translate(_unmatched_others)
+
+
+def suffix_array(text):
+    # Prefix doubling: suffixes are sorted by their first 8 bytes, then by
+    # (rank of the first h bytes, rank of the next h bytes) with h doubling
+    # until every rank is distinct. Ranks live in int64 arrays, numpy's
+    # when it is installed, so a build takes tens of bytes per base
+    # rather than a Python object per suffix and key.
+    try:
+        import numpy as np
+    except ImportError:
+        return _suffix_array_groups(text)
+    return _suffix_array_numpy(np, text)
+
+
+def _first_bytes(text):
+    # codes shifted up by one so the zero padding sorts the end of the text first
+    return bytes(text).translate(_shift_up) + bytes(8)
+
+
+def _suffix_array_numpy(np, text):
+    n = len(text)
+    if not n:
+        return array("q")
+    padded = np.frombuffer(_first_bytes(text), dtype=np.uint8)
+    key = np.zeros(n, dtype=np.uint64)
+    for j in range(8):
+        key = (key << np.uint64(8)) | padded[j:j + n]
+    sa = np.argsort(key, kind="stable")
+    fresh = np.ones(n, dtype=bool)
+    fresh[1:] = key[sa[1:]] != key[sa[:-1]]
+    del key
+    rank = np.empty(n, dtype=np.int64)
+    h = 8
+    while True:
+        # ranks start at 1, so 0 past the end of the text sorts first
+        rank[sa] = np.cumsum(fresh)
+        if rank[sa[-1]] == n:
+            return sa
+        second = np.zeros(n, dtype=np.int64)
+        if h < n:
+            second[:n - h] = rank[h:]
+        sa = np.lexsort((second, rank))
+        fresh[1:] = (rank[sa[1:]] != rank[sa[:-1]]) | (second[sa[1:]] != second[sa[:-1]])
+        del second
+        h *= 2
+
+
+def _suffix_array_groups(text):
+    # Without numpy: suffixes are bucketed by their first two bytes and
+    # each bucket sorted by eight, after which only the groups of suffixes
+    # still tied are sorted again, by the rank h bytes on. A suffix's rank
+    # is the end of its group in the array, so a group can be split and
+    # re-ranked in place while others still sort by the ranks around it
+    # (Larsson and Sadakane). Tied groups are kept as flat spans.
+    n = len(text)
+    padded = _first_bytes(text)
+    buckets = {}
+    for i in range(n):
+        buckets.setdefault(padded[i] * 6 + padded[i + 1], array("q")).append(i)
+    sa = array("q")
+    rank = array("q", bytes(8 * n))
+    tied = array("q")
+    for bucket in sorted(buckets):
+        positions = sorted(buckets.pop(bucket), key=lambda i: padded[i:i + 8])
+        _split(positions, [padded[i:i + 8] for i in positions], len(sa), rank, tied)
+        sa.extend(positions)
+    h = 8
+    while tied:
+        spans, tied = tied, array("q")
+        key = lambda i: rank[i + h] if i + h < n else -1
+        for j in range(0, len(spans), 2):
+            start, end = spans[j], spans[j + 1]
+            if end - start == 2:
+                # repeats leave mostly pairs, settled without a sort
+                a, b = sa[start], sa[start + 1]
+                key_a, key_b = key(a), key(b)
+                if key_a == key_b:
+                    tied.extend((start, end))
+                    continue
+                if key_a > key_b:
+                    a, b = b, a
+                    sa[start], sa[start + 1] = a, b
+                rank[a] = start + 1
+                rank[b] = end
+                continue
+            keys = sorted((key(i), i) for i in sa[start:end])
+            positions = [i for k, i in keys]
+            sa[start:end] = array("q", positions)
+            _split(positions, [k for k, i in keys], start, rank, tied)
+        h *= 2
+    return sa
+
+
+def _split(positions, keys, start, rank, tied):
+    # ranks the positions placed at sa[start:], sorted by keys, by the end
+    # of their group and adds the spans of groups of more than one to tied
+    end = len(positions)
+    for j in reversed(range(len(positions))):
+        if j + 1 < len(positions) and keys[j] != keys[j + 1]:
+            if end - j > 2:
+                tied.extend((start + j + 1, start + end))
+            end = j + 1
+        rank[positions[j]] = start + end
+    if end > 1:
+        tied.extend((start, start + end))
+
+
+def build(database, masks=None):
+    # (subject starts, suffix array, text); masks[i] are the masked runs
+    # of subject i
+    starts = array("q")
+    text = bytearray()
+    for subject_index, seq in enumerate(database):
+        starts.append(len(text))
+        text += text_codes(seq, masks[subject_index] if masks is not None else ())
+        text.append(STOP)
+    starts.append(len(text))
+    return starts, suffix_array(text), text
+
+
+def write(path, starts, sa, text):
+    with open(path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, VERSION, len(starts) - 1, len(text)))
+        starts.tofile(out)
+        out.write(memoryview(sa))
+        out.write(text)
+
+
+class SuffixArray:
+    # Memory-mapped suffix array file.
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap)
+        magic, version, n_subjects, n = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: not a blastn suffix array")
+        words = self.buffer[HEADER.size:HEADER.size + 8 * (n_subjects + 1 + n)].cast("q")
+        self.starts = words[:n_subjects + 1]
+        self.sa = words[n_subjects + 1:]
+        self.text_offset = HEADER.size + 8 * (n_subjects + 1 + n)
+        self._words = words
+
+    def interval(self, word):
+        # [lo, hi) of the suffixes starting with word (code bytes)
+        m = len(word)
+        t = self.text_offset
+        text = self._mmap
+        key = lambda p: text[t + p:t + p + m]
+        return bisect_left(self.sa, word, key=key), bisect_right(self.sa, word, key=key)
+
+    def narrow(self, lo, hi, depth, code):
+        # [lo, hi) of the suffixes within lo..hi, which share their first
+        # depth bytes, whose next byte is code
+        t = self.text_offset + depth
+        text = self._mmap
+        key = lambda p: text[t + p]
+        return bisect_left(self.sa, code, lo, hi, key=key), bisect_right(self.sa, code, lo, hi,
+                                                                         key=key)
+
+    def maximal_matches(self, codes, start, k):
+        # (length, text position) of the maximal exact matches of the
+        # query codes from start, at least k long. The interval of the
+        # first k bytes is narrowed one byte at a time as the match
+        # extends; the suffixes a step drops are the matches ending there.
+        # Matches that extend to the left are not maximal and are left out.
+        end = len(codes) - start
+        if end < k:
+            return []
+        lo, hi = self.interval(codes[start:start + k])
+        found = []
+        depth = k
+        while lo < hi:
+            if depth < end:
+                next_lo, next_hi = self.narrow(lo, hi, depth, codes[start + depth])
+            else:
+                next_lo = next_hi = hi
+            for j in (*range(lo, next_lo), *range(next_hi, hi)):
+                found.append((depth, self.sa[j]))
+            lo, hi = next_lo, next_hi
+            depth += 1
+        if start:
+            text = self._mmap
+            t = self.text_offset - 1
+            found = [(n, p) for n, p in found if not p or text[t + p] != codes[start - 1]]
+        return found
+
+    def locate(self, p):
+        # (subject, position) of a text position
+        subject_index = bisect_right(self.starts, p) - 1
+        return subject_index, p - self.starts[subject_index]
+
+    def occurrences(self, word, subject_range=None):
+        # (subject, position) of every occurrence, in subject order
+        lo, hi = self.interval(word)
+        found = [self.locate(p) for p in sorted(self.sa[lo:hi])]
+        if subject_range is not None:
+            a = bisect_left(found, (subject_range[0], -1))
+            b = bisect_left(found, (subject_range[1], -1))
+            found = found[a:b]
+        return found
+
+    def close(self):
+        for view in (self.starts, self.sa, self._words, self.buffer):
+            view.release()
+        self._mmap.close()
+        self._file.close()
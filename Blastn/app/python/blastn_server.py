@@ -0,0 +1,116 @@
+# blastn search service
+#
+# Keeps one warm Searcher (database plus k-mer index) in memory and
+# answers queries over a Unix socket, so per-query latency is the search
+# itself rather than reloading the database. Each request is one JSON
+# line
+#
+#   {"query": "AGCTGAC", "params": {"top": 10}}
+#
+# answered by one JSON line {"results": [...], "best": [...]}, or
+# {"error": "..."} for a request that fails. Searches run in a thread pool, so
+# many clients are served concurrently and a slow query does not stall
+# the event loop.
+import argparse
+import asyncio
+import json
+import os
+import socket
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+import blastn
+
+LINE_LIMIT = 1 << 24
+
+
+def search(searcher, query, params):
+    # hits only become alignment strings for the reply
+    if params and "shard" in params:
+        raise ValueError("shard is set by sharded searches, not by clients")
+    results, best = searcher.search(query, params)
+    database = searcher.subjects
+    return {"results": [res.as_list(query, database) for res in results],
+            "best": [res.as_list(query, database) for res in best]}
+
+
+async def handle(searcher, executor, reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                reply = await loop.run_in_executor(
+                    executor, search, searcher, request["query"], request.get("params"))
+            except Exception as e:
+                # whatever a request breaks, the connection keeps serving
+                reply = {"error": f"{type(e).__name__}: {e}"}
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def serve(searcher, path, threads):
+    # a socket left behind by an earlier run is replaced; any other file
+    # at path is not ours to remove, and binding then fails
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    with ThreadPoolExecutor(threads) as executor:
+        server = await asyncio.start_unix_server(
+            lambda reader, writer: handle(searcher, executor, reader, writer),
+            path=path, limit=LINE_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+
+def request(path, query, params=None):
+    # blocking one-shot client, mainly for scripts and testing
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps({"query": query, "params": params or {}}).encode() + b"\n")
+        with sock.makefile("rb") as file:
+            return json.loads(file.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="warm blastn search service")
+    parser.add_argument("database", nargs="?", default="database.txt")
+    parser.add_argument("--socket", default="blastn.sock")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="searches run concurrently in this many threads")
+    parser.add_argument("--seed", metavar="TEMPLATE",
+                        help="spaced seed such as 11011011 instead of contiguous words")
+    parser.add_argument("--dust", type=int, default=0, metavar="LEVEL",
+                        help="mask low-complexity database regions out of the index")
+    parser.add_argument("--suffix-array", action="store_true",
+                        help="seed from an on-disk suffix array instead of the k-mer index")
+    parser.add_argument("--minimizer", type=int, default=0, metavar="W",
+                        help="index only the minimizer of every W words to save memory")
+    parser.add_argument("--chunk", type=int, default=0, metavar="N",
+                        help="search long subjects as windows of N bases")
+    parser.add_argument("--overlap", type=int, default=blastn.chunk_overlap, metavar="N",
+                        help="bases shared by neighbouring windows; at least the longest query")
+    parser.add_argument("--no-index-cache", action="store_true")
+    args = parser.parse_args()
+
+    searcher = blastn.Searcher.open(args.database, index_cache=not args.no_index_cache,
+                                    seed=args.seed, dust=args.dust,
+                                    suffix_array=args.suffix_array, minimizer=args.minimizer,
+                                    chunk=args.chunk, overlap=args.overlap)
+    print(f"serving {len(searcher.subjects)} subjects on {args.socket}")
+    try:
+        asyncio.run(serve(searcher, args.socket, args.threads))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
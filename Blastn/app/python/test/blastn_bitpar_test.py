@@ -0,0 +1,95 @@
+#=========================================================================
+# blastn_bitpar_test.py
+#=========================================================================
+# The packed walk against ungapped_extend() on random sequence pairs,
+# from packed strings and from a packed database file, and the packed
+# engine against the scalar one.
+
+import random
+
+import pytest
+
+import blastn
+import blastn_bitpar
+import blastn_packed
+import blastn_profile
+from conftest import keys, mutate, random_bases, random_search, write_database
+
+
+def random_pair(rng, k):
+    # a query and a subject that is either unrelated or a mutated slice of
+    # the query between random flanks, so walks run from a step to the end
+    query = random_bases(rng, rng.randint(k, 200))
+    if rng.random() < 0.5:
+        subject = random_bases(rng, rng.randint(k, 200))
+    else:
+        start = rng.randint(0, len(query) - k)
+        subject = (random_bases(rng, rng.randint(0, 40))
+                   + mutate(rng, query[start:], rng.choice([0, 0.03, 0.15]))
+                   + random_bases(rng, rng.randint(0, 40)))
+    return query, subject
+
+
+def packed_only(seq):
+    # the packed bases without the text, as a packed database gives them
+    return blastn_bitpar.Sequence(blastn_bitpar.Sequence.from_str(seq).packed, len(seq))
+
+
+@pytest.mark.parametrize("sequence", [blastn_bitpar.Sequence.from_str, packed_only])
+def test_extend_matches_scalar(sequence):
+    rng = random.Random(0xb17a)
+    for _ in range(3000):
+        k = rng.choice([3, 4, 8, 11])
+        query, subject = random_pair(rng, k)
+        word_index = rng.randint(0, len(query) - k)
+        subject_pos = rng.randint(0, len(subject) - k)
+        xdrop = rng.choice([3, 10, 20, 40])
+        seed_score = rng.choice([None, k - 4])
+        expected_stats = {"bases_compared": 0, "xdrop_terminations": 0}
+        stats = dict(expected_stats)
+        expected = blastn.ungapped_extend(query, subject, word_index, subject_pos, k, xdrop,
+                                          seed_score, expected_stats)
+        result = blastn_bitpar.extend(sequence(query), sequence(subject), word_index,
+                                      subject_pos, k, xdrop, seed_score, stats)
+        assert result == expected
+        assert stats == expected_stats
+
+
+def test_extend_reads_packed_database(tmp_path):
+    rng = random.Random(0xdb)
+    k = 8
+    query = random_bases(rng, 300)
+    subjects = [random_bases(rng, rng.randint(k, 100)) + mutate(rng, query[50:250], 0.05)
+                + random_bases(rng, rng.randint(0, 100)) for _ in range(10)]
+    text_path = write_database(tmp_path / "db.txt", subjects)
+    blastn_packed.pack_database(text_path, str(tmp_path / "db.pk"))
+    packed_query = blastn_bitpar.Sequence.from_str(query)
+    with blastn_packed.PackedDatabase(str(tmp_path / "db.pk")) as database:
+        for subject_index, subject in enumerate(subjects):
+            packed = blastn_bitpar.Sequence(database.packed(subject_index),
+                                            database.subject_length(subject_index))
+            for _ in range(50):
+                word_index = rng.randint(0, len(query) - k)
+                subject_pos = rng.randint(0, len(subject) - k)
+                assert (blastn_bitpar.extend(packed_query, packed, word_index, subject_pos, k, 20)
+                        == blastn.ungapped_extend(query, subject, word_index, subject_pos, k, 20))
+            # the database cannot close while a slice of its mapping is alive
+            packed.packed.release()
+
+
+@pytest.mark.parametrize("k", [3, 8])
+@pytest.mark.parametrize("params", [{}, {"dedup": False, "xdrop": 8}, {"top": 5}])
+def test_engine_matches_scalar(k, params):
+    rng = random.Random(0xe9)
+    for _ in range(3):
+        queries, subjects = random_search(rng)
+        searcher = blastn.Searcher(subjects, k=k)
+        for query in queries:
+            profiles = {}
+            searched = {}
+            for engine in ("scalar", "packed"):
+                profiles[engine] = blastn_profile.Profile()
+                searched[engine] = searcher.search(query, dict(params, engine=engine),
+                                                   profiles[engine])
+            assert keys(searched["packed"]) == keys(searched["scalar"])
+            assert profiles["packed"].counts == profiles["scalar"].counts
@@ -0,0 +1,75 @@
+#=========================================================================
+# blastn_bloom_test.py
+#=========================================================================
+# Per-subject Bloom filters: no word is ever ruled out, and a filtered
+# batch search equals an unfiltered one without reading the subjects it
+# skips.
+
+import random
+
+import pytest
+
+import blastn
+import blastn_bloom
+import blastn_packed
+from conftest import keys, random_bases, random_search, write_database
+
+
+def many_subjects(rng):
+    # queries and a database of mostly short subjects holding none of them
+    queries, subjects = random_search(rng, n_subjects=8)
+    subjects += [random_bases(rng, rng.randint(1, 60)) for _ in range(60)]
+    rng.shuffle(subjects)
+    return queries, subjects
+
+
+def test_filters_hold_every_word():
+    rng = random.Random(0xb10)
+    subject_codes = [[rng.getrandbits(22) for _ in range(rng.randint(0, 300))]
+                     for _ in range(50)]
+    for bits_per_word in (1, 4, 8):
+        filters = blastn_bloom.SubjectFilters(*blastn_bloom.build(
+            ((len(codes), codes) for codes in subject_codes), bits_per_word), bits_per_word)
+        for subject_index, codes in enumerate(subject_codes):
+            for code in codes:
+                assert filters.probe([code])(subject_index)
+
+
+@pytest.mark.parametrize("k", [8, 11])
+@pytest.mark.parametrize("params", [{}, {"strand": "both", "top": 5}, {"mem": True},
+                                    {"exact": True}])
+def test_filtered_batch_matches_unfiltered(k, params):
+    rng = random.Random(0xb1f)
+    for _ in range(3):
+        queries, subjects = many_subjects(rng)
+        filtered = blastn.Searcher(subjects, k=k, bloom=4)
+        unfiltered = blastn.Searcher(subjects, k=k)
+        assert [keys(searched) for searched in filtered.batch_search(queries, params)] == [
+            keys(searched) for searched in unfiltered.batch_search(queries, params)]
+
+
+def test_ruled_out_subjects_are_not_read(tmp_path, monkeypatch):
+    # subjects long enough to be worth a probe for a short query
+    rng = random.Random(0xbad)
+    queries = [random_bases(rng, 40)]
+    subjects = [random_bases(rng, rng.randint(200, 300)) for _ in range(40)]
+    for subject_index in (3, 4, 20):
+        subjects[subject_index] += queries[0]
+    path = write_database(tmp_path / "db.txt", subjects)
+    searcher = blastn.Searcher.open(path, k=11, bloom=8)
+    assert isinstance(searcher.database, blastn_packed.PackedDatabase)
+    read = []
+    packed_read = searcher.database.read
+
+    def recorded(lo, hi):
+        read.extend(range(lo, hi))
+        return packed_read(lo, hi)
+    monkeypatch.setattr(searcher.database, "read", recorded)
+    searched = searcher.batch_search(queries)
+    may_hit = searcher.filters.probe(code for query in queries
+                                     for pos, code in searcher.query_codes(query, 0))
+    assert read == [i for i in range(len(subjects)) if may_hit(i)]
+    assert len(read) < len(subjects) // 2
+    expected = blastn.Searcher(subjects, k=11)
+    assert [keys(result) for result in searched] == [
+        keys(expected.search(query)) for query in queries]
@@ -0,0 +1,80 @@
+#=========================================================================
+# blastn_chunk_test.py
+#=========================================================================
+# Searches over subject windows against searches over whole subjects.
+
+import random
+
+import pytest
+
+import blastn
+import blastn_chunk
+import blastn_packed
+from conftest import has_numpy, keys, random_bases, random_search, write_database
+
+PARAMS = [{}, {"strand": "both"}, {"top": 5}, {"top": 3, "per_subject": 1},
+          {"dedup": False}, {"two_hit": 20}, {"mem": True}]
+
+
+def long_search(rng):
+    # queries and subjects several windows long
+    queries, subjects = random_search(rng)
+    return queries, [random_bases(rng, rng.randint(0, 150)) + subject
+                     + random_bases(rng, rng.randint(0, 150)) for subject in subjects]
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_windows_search_like_whole_subjects(params):
+    rng = random.Random(0xc4)
+    for _ in range(3):
+        queries, subjects = long_search(rng)
+        chunked = blastn.Searcher(subjects, k=4, chunk=60, overlap=120)
+        whole = blastn.Searcher(subjects, k=4)
+        for query in queries:
+            assert keys(chunked.search(query, params)) == keys(whole.search(query, params))
+
+
+@pytest.mark.skipif(not has_numpy(), reason="gapped extension needs numpy")
+def test_gapped_windows_search_like_whole_subjects():
+    rng = random.Random(0x9c4)
+    queries, subjects = long_search(rng)
+    params = {"gapped": True, "strand": "both"}
+    chunked = blastn.Searcher(subjects, k=8, chunk=60, overlap=140)
+    whole = blastn.Searcher(subjects, k=8)
+    for query in queries:
+        assert keys(chunked.search(query, params)) == keys(whole.search(query, params))
+
+
+def test_windows_of_a_packed_database(tmp_path):
+    rng = random.Random(0x9ac)
+    queries, subjects = long_search(rng)
+    path = write_database(tmp_path / "db.txt", subjects)
+    chunked = blastn.Searcher.open(path, k=4, chunk=60, overlap=120)
+    assert isinstance(chunked.subjects, blastn_packed.PackedDatabase)
+    assert isinstance(chunked.database, blastn_chunk.ChunkedDatabase)
+    whole = blastn.Searcher(subjects, k=4)
+    for query in queries:
+        assert keys(chunked.search(query)) == keys(whole.search(query))
+
+
+def test_windows_cover_each_subject_once():
+    rng = random.Random(0x3c)
+    subjects = [random_bases(rng, n) for n in (0, 1, 59, 60, 61, 250)]
+    windows = blastn_chunk.ChunkedDatabase(subjects, 60, 25)
+    for subject_index, subject in enumerate(subjects):
+        owned = ""
+        for window in range(len(windows)):
+            if windows.subjects[window] == subject_index:
+                begin = windows.begins[window]
+                start = windows.owned[window]
+                assert windows[window] == subject[begin:start + 60 + 25]
+                owned += subject[start:start + 60]
+        assert owned == subject
+
+
+def test_short_overlaps_are_refused():
+    with pytest.raises(ValueError):
+        blastn.Searcher(["ACGT" * 40], k=11, chunk=60, overlap=8)
+    searcher = blastn.Searcher(["ACGT" * 40], k=4, chunk=60, overlap=20)
+    with pytest.raises(ValueError):
+        searcher.search("ACGT" * 6)
@@ -0,0 +1,157 @@
+#=========================================================================
+# blastn_dust_test.py
+#=========================================================================
+# DUST masking against a window-by-window recount, the masked words left
+# out of seeding, and the masks computed once per subject and cached next
+# to the database.
+
+import os
+import random
+from collections import Counter
+
+import blastn
+import blastn_dust
+import blastn_index
+from conftest import keys, random_bases, random_search, write_database
+
+
+def random_repeats(rng):
+    # random stretches between repeats of short units, some with an N
+    parts = []
+    for _ in range(rng.randint(1, 6)):
+        if rng.random() < 0.5:
+            parts.append(random_bases(rng, rng.randint(0, 80)))
+        else:
+            unit = "".join(rng.choice("ACGTN") for _ in range(rng.randint(1, 4)))
+            parts.append(unit * rng.randint(1, 40))
+    return "".join(parts)
+
+
+def recounted_bases(seq, level, window=blastn_dust.WINDOW):
+    # the masked bases, counting the triplets of every window afresh
+    triplets = [seq[i:i + 3] if set(seq[i:i + 3]) <= set("ACGT") else None
+                for i in range(len(seq) - 2)]
+    span = min(window, len(seq)) - 2
+    masked = set()
+    if span < 2:
+        return masked
+    checked = 0
+    for i in range(span - 1, len(triplets)):
+        counts = Counter(t for t in triplets[i - span + 1:i + 1] if t is not None)
+        if sum(c * (c - 1) // 2 for c in counts.values()) > level * (span - 1):
+            for j in range(max(i - span + 1, checked), i + 1):
+                if triplets[j] is not None and counts[triplets[j]] > 1:
+                    masked.update(range(j, j + 3))
+            checked = i + 1
+    return masked
+
+
+def run_bases(runs):
+    assert list(runs) == sorted(runs) and len(set(runs)) == len(runs)
+    return {pos for i in range(0, len(runs), 2) for pos in range(runs[i], runs[i + 1])}
+
+
+def test_runs_match_recount():
+    rng = random.Random(0xd57)
+    for _ in range(500):
+        seq = random_repeats(rng)
+        level = rng.choice([5, 20, 40])
+        assert run_bases(blastn_dust.dust_runs(seq, level)) == recounted_bases(seq, level)
+
+
+def test_repeats_are_masked():
+    rng = random.Random(0xaaa)
+    flank = random_bases(rng, 200)
+    runs = blastn_dust.dust_runs(flank + "A" * 100 + flank[::-1])
+    masked = run_bases(runs)
+    assert set(range(200, 300)) <= masked
+    assert len(masked) < 110
+    assert not blastn_dust.dust_runs(random_bases(rng, 2000))
+
+
+def test_unmasked_words_clear_the_runs():
+    rng = random.Random(0x0c1)
+    for _ in range(300):
+        seq = random_repeats(rng)
+        k = rng.choice([3, 4, 8])
+        runs = blastn_dust.dust_runs(seq, rng.choice([5, 20]))
+        masked = run_bases(runs)
+        codes = [(pos, None) for pos in range(len(seq) - k + 1)]
+        assert [pos for pos, code in blastn_dust.unmasked(codes, runs, k)] == [
+            pos for pos, code in codes if masked.isdisjoint(range(pos, pos + k))]
+
+
+def test_masked_words_are_not_indexed():
+    rng = random.Random(0x1d5)
+    queries, subjects = random_search(rng)
+    subjects.append(random_bases(rng, 50) + "A" * 90 + random_bases(rng, 50))
+    k = 4
+    searcher = blastn.Searcher(subjects, k=k, dust=20)
+    expected = []
+    for subject_index, subject in enumerate(subjects):
+        masked = run_bases(blastn_dust.dust_runs(subject, 20))
+        expected += [(subject_index, pos) for pos in range(len(subject) - k + 1)
+                     if masked.isdisjoint(range(pos, pos + k))]
+    assert sorted(zip(searcher.index_subjects, searcher.index_positions)) == expected
+    assert len(expected) < sum(len(subject) - k + 1 for subject in subjects)
+
+
+def count_masking(monkeypatch):
+    # counts the sequences dust_runs masks
+    masked = Counter()
+    dust_runs = blastn_dust.dust_runs
+
+    def counted(seq, *args):
+        masked[seq] += 1
+        return dust_runs(seq, *args)
+    monkeypatch.setattr(blastn_dust, "dust_runs", counted)
+    return masked
+
+
+def test_subjects_are_masked_once(monkeypatch):
+    rng = random.Random(0x0ce)
+    queries, subjects = random_search(rng)
+    masked = count_masking(monkeypatch)
+    searcher = blastn.Searcher(subjects, k=4, dust=20, bloom=8)
+    searcher.batch_search(queries)
+    searcher.batch_search(queries)
+    assert masked == Counter(subjects)
+
+
+def test_shard_masks_its_subjects(monkeypatch):
+    rng = random.Random(0x5a4)
+    queries, subjects = random_search(rng)
+    masked = count_masking(monkeypatch)
+    blastn.Searcher(subjects, k=4, dust=20, subject_range=range(3, 7))
+    assert masked == Counter(subjects[3:7])
+
+
+def test_masks_are_cached(tmp_path, monkeypatch):
+    rng = random.Random(0xdc)
+    queries, subjects = random_search(rng)
+    path = write_database(tmp_path / "db.txt", subjects)
+    expected = blastn.Searcher(subjects, k=4, dust=20)
+    expected = [keys(searched) for searched in expected.batch_search(queries)]
+    assert [keys(searched) for searched
+            in blastn.Searcher.open(path, k=4, dust=20).batch_search(queries)] == expected
+    digest = blastn_index.content_hash(path)
+    mask_path = blastn_index.mask_path(path, digest, 20)
+    assert os.path.exists(mask_path)
+
+    # the index of another word size, the Bloom filters, the suffix array
+    # and batch searches all read the stored masks
+    masked = count_masking(monkeypatch)
+    searcher = blastn.Searcher.open(path, k=4, dust=20)
+    assert [keys(searched) for searched in searcher.batch_search(queries)] == expected
+    blastn.Searcher.open(path, k=5, dust=20, bloom=8).batch_search(queries)
+    blastn.Searcher.open(path, k=4, dust=20, suffix_array=True)
+    assert not masked
+
+    # windows mask their own text
+    blastn.Searcher.open(path, k=4, dust=20, chunk=60, overlap=20)
+    assert os.path.exists(blastn_index.mask_path(path, digest, 20, (60, 20)))
+
+    write_database(tmp_path / "db.txt", ["ACGT" + subject for subject in subjects])
+    blastn.Searcher.open(path, k=4, dust=20)
+    assert not os.path.exists(mask_path)
+    assert not [name for name in os.listdir(tmp_path) if digest in name]
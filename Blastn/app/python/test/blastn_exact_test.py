@@ -0,0 +1,74 @@
+#=========================================================================
+# blastn_exact_test.py
+#=========================================================================
+# The exact-match fast path: substring search of text and packed
+# databases, and searches that report occurrences in place of seeding.
+
+import random
+
+import pytest
+
+import blastn
+import blastn_exact
+import blastn_packed
+from conftest import keys, random_bases, random_search, write_database
+
+
+def test_packed_find_matches_text_find(tmp_path):
+    rng = random.Random(0xf1d)
+    subjects = [random_bases(rng, rng.randint(1, 80)) for _ in range(30)]
+    subjects += ["A" * 50, "ACGT" * 12 + "A"]
+    path = write_database(tmp_path / "db.txt", subjects)
+    blastn_packed.pack_database(path, str(tmp_path / "db.pk"))
+    with blastn_packed.PackedDatabase(str(tmp_path / "db.pk")) as packed:
+        for _ in range(500):
+            subject = rng.choice(subjects)
+            start = rng.randint(0, len(subject) - 1)
+            query = rng.choice([subject[start:start + rng.randint(1, 30)],
+                                random_bases(rng, rng.randint(1, 6)), "AAAA", "ACGTA"])
+            lo = rng.randint(0, len(subjects))
+            subject_range = range(lo, rng.randint(lo, len(subjects)))
+            assert (list(blastn_exact.find(packed, query, subject_range))
+                    == list(blastn_exact.find_text(subjects, query, subject_range)))
+
+
+def test_exact_replaces_seeding_of_matched_strands():
+    # a subject strand holding the whole query reports its occurrences;
+    # every other subject strand reports what the seeded search finds
+    rng = random.Random(0xec7)
+    for params in ({}, {"strand": "both"}):
+        for _ in range(5):
+            queries, database = random_search(rng)
+            searcher = blastn.Searcher(database, k=4)
+            for query in queries + [rng.choice(database)[:25], "AGTG"]:
+                strands = [query]
+                if params.get("strand") == "both":
+                    strands.append(blastn.reverse_complement(query))
+                occurrences = [(len(query), 0, pos, len(query), subject_index, len(query),
+                                0, pos, None, strand)
+                               for strand, seq in enumerate(strands)
+                               for subject_index, subject in enumerate(database)
+                               for pos in range(len(subject))
+                               if subject.startswith(seq, pos)]
+                matched = {(key[4], key[9]) for key in occurrences}
+                seeded = [key for key in keys(searcher.search(query, params))[0]
+                          if (key[4], key[9]) not in matched]
+                results = keys(searcher.search(query, dict(params, exact=True)))[0]
+                assert sorted(results) == sorted(seeded + occurrences)
+
+
+@pytest.mark.parametrize("options", [{}, {"chunk": 30, "overlap": 120}])
+def test_exact_shards_add_up(options):
+    # shards of a search, as parallel workers run them, report every hit once
+    rng = random.Random(0x5ec)
+    queries, database = random_search(rng)
+    searcher = blastn.Searcher(database, k=4, **options)
+    n = len(searcher.database)
+    for query in queries + [rng.choice(database)[3:30]]:
+        params = {"exact": True, "strand": "both"}
+        expected = keys(searcher.search(query, params))[0]
+        for bounds in ([0, n], [0, n // 2, n], [0, 1, n // 3, n - 1, n]):
+            sharded = []
+            for lo, hi in zip(bounds, bounds[1:]):
+                sharded += keys(searcher.search(query, dict(params, shard=(lo, hi))))[0]
+            assert sorted(sharded) == sorted(expected)
@@ -0,0 +1,101 @@
+#=========================================================================
+# blastn_index_test.py
+#=========================================================================
+# The on-disk index cache: reuse, invalidation and clean-up.
+
+import os
+import random
+
+import pytest
+
+import blastn
+import blastn_index
+import blastn_packed
+from conftest import keys, random_search, write_database
+
+
+def cache_files(tmp_path):
+    return sorted(name for name in os.listdir(tmp_path) if name.startswith("db.txt."))
+
+
+def test_cache_is_reused(tmp_path, monkeypatch):
+    rng = random.Random(0xca5)
+    queries, subjects = random_search(rng)
+    path = write_database(tmp_path / "db.txt", subjects)
+    expected = [keys(blastn.Searcher(subjects, k=4).search(query)) for query in queries]
+
+    searcher = blastn.Searcher.open(path, k=4)
+    assert isinstance(searcher.database, blastn_packed.PackedDatabase)
+    assert [keys(searcher.search(query)) for query in queries] == expected
+    digest = blastn_index.content_hash(path)
+    assert cache_files(tmp_path) == [f"db.txt.{digest}.{suffix}"
+                                     for suffix in ("k4.idx", "pk", "stamp")]
+
+    # nothing is hashed, packed or indexed again
+    def fail(*args):
+        raise AssertionError("rebuilt")
+    monkeypatch.setattr(blastn_index.hashlib, "sha256", fail)
+    monkeypatch.setattr(blastn_packed, "pack_database", fail)
+    monkeypatch.setattr(blastn.Searcher, "build_index", fail)
+    searcher = blastn.Searcher.open(path, k=4)
+    assert [keys(searcher.search(query)) for query in queries] == expected
+
+
+def test_edited_database_replaces_stale_files(tmp_path):
+    rng = random.Random(0xed1)
+    queries, subjects = random_search(rng)
+    path = write_database(tmp_path / "db.txt", subjects)
+    blastn.Searcher.open(path, k=4)
+    old = blastn_index.content_hash(path)
+    # files the cache did not write are left alone
+    for name in ("db.txt.notes", f"db.txt.{old}.bak", "db.txt.txt", "db.txt.0123456789abcdef"):
+        (tmp_path / name).write_text("")
+
+    subjects[0] = "ACGT" + subjects[0]
+    write_database(tmp_path / "db.txt", subjects)
+    searcher = blastn.Searcher.open(path, k=4)
+    new = blastn_index.content_hash(path)
+    assert new != old
+    assert cache_files(tmp_path) == sorted(
+        [f"db.txt.{new}.{suffix}" for suffix in ("k4.idx", "pk", "stamp")]
+        + ["db.txt.notes", f"db.txt.{old}.bak", "db.txt.txt", "db.txt.0123456789abcdef"])
+    expected = blastn.Searcher(subjects, k=4)
+    for query in queries:
+        assert keys(searcher.search(query)) == keys(expected.search(query))
+
+
+def test_touched_database_is_hashed_again(tmp_path):
+    path = write_database(tmp_path / "db.txt", ["ACGTACGT"])
+    digest = blastn_index.content_hash(path)
+    stamp = blastn_index.stamp_path(path, digest)
+    # a stamp only vouches for the size and time it was written for
+    os.utime(path, ns=(0, 0))
+    assert blastn_index.content_hash(path) == digest
+    with open(stamp) as file:
+        assert file.read() == f"{os.path.getsize(path)} 0\n"
+
+
+def test_unpackable_database_is_not_packed_again(tmp_path, monkeypatch):
+    path = write_database(tmp_path / "db.txt", ["ACGTNNACGT", "GGGTTTAAAC"])
+    searcher = blastn.Searcher.open(path, k=4)
+    assert not isinstance(searcher.database, blastn_packed.PackedDatabase)
+    digest = blastn_index.content_hash(path)
+    assert os.path.exists(blastn_index.no_pack_path(path, digest))
+
+    def fail(*args):
+        raise AssertionError("packed again")
+    monkeypatch.setattr(blastn_packed, "pack_database", fail)
+    searcher = blastn.Searcher.open(path, k=4)
+    assert [res.subject_index for res in searcher.search("ACGT")[0]] == [0, 0]
+
+
+def test_read_only_location_falls_back_to_memory(tmp_path):
+    if os.geteuid() == 0:
+        pytest.skip("root ignores directory permissions")
+    path = write_database(tmp_path / "db.txt", ["ACGTACGT"])
+    os.chmod(tmp_path, 0o555)
+    try:
+        searcher = blastn.Searcher.open(path, k=4)
+        assert len(searcher.search("ACGT")[0]) == 2
+    finally:
+        os.chmod(tmp_path, 0o755)
@@ -0,0 +1,77 @@
+#=========================================================================
+# blastn_minimizer_test.py
+#=========================================================================
+# Minimizer sampling against a window-by-window minimum, and the index
+# and searches built from it.
+
+import random
+
+import pytest
+
+import blastn
+import blastn_minimizer
+from conftest import keys, random_bases, random_search
+
+
+def brute_force_minimizers(codes, w, bits, n):
+    # the (pos, code) pairs that are the smallest (hash, pos) of some window
+    codes = dict(codes)
+    w = min(w, n)
+    kept = set()
+    for start in range(n - w + 1):
+        window = [(blastn_minimizer.word_hash(codes[pos], bits), pos)
+                  for pos in range(start, start + w) if pos in codes]
+        if window:
+            kept.add(min(window)[1])
+    return [(pos, codes[pos]) for pos in sorted(kept)]
+
+
+def test_minimizers_match_brute_force():
+    rng = random.Random(0x313)
+    for _ in range(1000):
+        k = rng.choice([2, 3, 4])
+        seq = random_bases(rng, rng.randint(k, 80))
+        if rng.random() < 0.3:
+            seq = seq[:10] + "A" * rng.randint(1, 30) + seq[10:]
+        n = len(seq) - k + 1
+        codes = blastn.kmer_codes(seq, k)
+        # gaps in the codes, as masked or non-ACGT words leave
+        codes = [(pos, code) for pos, code in codes if rng.random() < 0.8]
+        w = rng.randint(1, 15)
+        assert (list(blastn_minimizer.minimizers(iter(codes), w, 2 * k, n))
+                == brute_force_minimizers(codes, w, 2 * k, n))
+
+
+def test_index_holds_the_minimizers():
+    rng = random.Random(0x1d3)
+    queries, subjects = random_search(rng)
+    searcher = blastn.Searcher(subjects, k=4, minimizer=5)
+    expected = sorted((subject_index, pos)
+                      for subject_index, subject in enumerate(subjects)
+                      for pos, code in brute_force_minimizers(
+                          blastn.kmer_codes(subject, 4), 5, 8, len(subject) - 3))
+    assert sorted(zip(searcher.index_subjects, searcher.index_positions)) == expected
+
+
+@pytest.mark.parametrize("w", [1, 4, 10])
+def test_long_matches_are_found(w):
+    # an exact match of w + k - 1 bases shares a minimizer with the query
+    rng = random.Random(0x10f + w)
+    k = 4
+    for _ in range(50):
+        subject = random_bases(rng, 200)
+        start = rng.randint(0, 200 - (w + k - 1))
+        query = random_bases(rng, 10) + subject[start:start + w + k - 1] + random_bases(rng, 10)
+        searcher = blastn.Searcher([subject], k=k, minimizer=w)
+        assert any(res.s_start <= start + w - 1 and start < res.s_start + res.length
+                   for res in searcher.search(query, {"dedup": False})[0])
+
+
+def test_every_word_at_w_one():
+    rng = random.Random(0x101)
+    queries, subjects = random_search(rng)
+    sampled = blastn.Searcher(subjects, k=4, minimizer=1)
+    full = blastn.Searcher(subjects, k=4)
+    for query in queries:
+        assert keys(sampled.search(query, {"strand": "both"})) == keys(
+            full.search(query, {"strand": "both"}))
@@ -0,0 +1,195 @@
+#=========================================================================
+# blastn_numpy_test.py
+#=========================================================================
+# Batched ungapped extension against ungapped_extend(), the numpy engine
+# against the scalar one, and the banded gapped extension against its own
+# edit string and a brute-force affine DP.
+
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import blastn
+import blastn_numpy
+import blastn_profile
+from conftest import keys, mutate, random_bases, random_search
+
+#-------------------------------------------------------------------------
+# batched ungapped extension
+#-------------------------------------------------------------------------
+
+
+def test_extend_batch_matches_scalar():
+    rng = random.Random(0x5ca1)
+    for _ in range(500):
+        k = rng.choice([4, 8, 11])
+        query = random_bases(rng, rng.randint(k, 400))
+        subjects = []
+        for _ in range(rng.randint(1, 4)):
+            if rng.random() < 0.5:
+                subjects.append(random_bases(rng, rng.randint(k, 300)))
+            else:
+                start = rng.randint(0, len(query) - k)
+                end = rng.randint(start + k, len(query))
+                subjects.append(random_bases(rng, rng.randint(0, 50))
+                                + mutate(rng, query[start:end], rng.choice([0, 0.02, 0.1]))
+                                + random_bases(rng, rng.randint(0, 50)))
+        bases = np.cumsum([0] + [len(subject) for subject in subjects])
+        rows = []
+        for _ in range(rng.randint(1, 30)):
+            subject_index = rng.randrange(len(subjects))
+            rows.append((subject_index, rng.randint(0, len(query) - k),
+                         rng.randint(0, len(subjects[subject_index]) - k)))
+        xdrop = rng.choice([5, 10, 20])
+        seed_scores = [rng.randint(k - 6, k) for _ in rows]
+
+        expected_stats = {"bases_compared": 0, "xdrop_terminations": 0}
+        stats = dict(expected_stats)
+        expected = [blastn.ungapped_extend(query, subjects[subject_index], word_index,
+                                           subject_pos, k, xdrop, seed_score, expected_stats)
+                    for (subject_index, word_index, subject_pos), seed_score
+                    in zip(rows, seed_scores)]
+        extents = blastn_numpy.extend_batch(
+            blastn_numpy.codes(query), blastn_numpy.codes("".join(subjects)),
+            [bases[row[0]] for row in rows], [len(subjects[row[0]]) for row in rows],
+            [row[1] for row in rows], [row[2] for row in rows], k, xdrop, seed_scores, stats)
+        assert list(zip(*(column.tolist() for column in extents))) == expected
+        assert stats == expected_stats
+
+
+@pytest.mark.parametrize("k,seed", [(3, None), (4, None), (None, "1101")])
+@pytest.mark.parametrize("params", [{}, {"dedup": False}, {"strand": "both", "top": 4}])
+def test_engine_matches_scalar(k, seed, params):
+    # the same hits from the same number of extensions: a batch skips the
+    # hits an earlier extension on their diagonal covers, as scalar does
+    rng = random.Random(0xe9)
+    for _ in range(3):
+        queries, subjects = random_search(rng)
+        # repeats put many hits on one diagonal
+        subjects.append("A" * 300)
+        searcher = blastn.Searcher(subjects, k=k, seed=seed)
+        for query in queries + ["A" * 40]:
+            profiles = {}
+            searched = {}
+            for engine in ("scalar", "numpy"):
+                profiles[engine] = blastn_profile.Profile()
+                searched[engine] = searcher.search(query, dict(params, engine=engine),
+                                                   profiles[engine])
+            assert keys(searched["numpy"]) == keys(searched["scalar"])
+            assert profiles["numpy"].counts == profiles["scalar"].counts
+
+#-------------------------------------------------------------------------
+# banded gapped extension
+#-------------------------------------------------------------------------
+
+MATCH, MISMATCH, GAP_OPEN, GAP_EXTEND = 1, -3, -5, -2
+
+
+def ops_score(query, subject, q_start, s_start, ops):
+    # score of an edit string; a gap of length L scores GAP_OPEN + L * GAP_EXTEND
+    score = 0
+    q, t = q_start, s_start
+    previous = "M"
+    for op in ops:
+        if op == "M":
+            score += MATCH if query[q] == subject[t] else MISMATCH
+            q += 1
+            t += 1
+        else:
+            score += GAP_EXTEND + (GAP_OPEN if op != previous else 0)
+            if op == "Q":
+                q += 1
+            else:
+                t += 1
+        previous = op
+    return score, q, t
+
+
+def best_prefix_score(q, t):
+    # best affine score of aligning a prefix of q with a prefix of t, by
+    # filling the whole Gotoh matrix (the empty alignment scores 0)
+    neg = float("-inf")
+    n, m = len(q), len(t)
+    H = [[neg] * (m + 1) for _ in range(n + 1)]
+    E = [[neg] * (m + 1) for _ in range(n + 1)]
+    F = [[neg] * (m + 1) for _ in range(n + 1)]
+    H[0][0] = 0
+    for i in range(n + 1):
+        for j in range(m + 1):
+            if j:
+                E[i][j] = max(H[i][j - 1] + GAP_OPEN + GAP_EXTEND, E[i][j - 1] + GAP_EXTEND)
+            if i:
+                F[i][j] = max(H[i - 1][j] + GAP_OPEN + GAP_EXTEND, F[i - 1][j] + GAP_EXTEND)
+            if i and j:
+                pair = MATCH if q[i - 1] == t[j - 1] else MISMATCH
+                H[i][j] = H[i - 1][j - 1] + pair
+            H[i][j] = max(H[i][j], E[i][j], F[i][j])
+    return max(max(row) for row in H)
+
+
+def random_gapped_pair(rng):
+    query = random_bases(rng, rng.randint(1, 40))
+    subject = list(mutate(rng, query, 0.1))
+    for _ in range(rng.randint(0, 3)):
+        at = rng.randint(0, len(subject))
+        if rng.random() < 0.5:
+            subject[at:at] = random_bases(rng, rng.randint(1, 4))
+        else:
+            del subject[at:at + rng.randint(1, 4)]
+    return query, "".join(subject) or "A"
+
+
+def test_gapped_score_matches_ops():
+    rng = random.Random(0x9a9)
+    for _ in range(300):
+        query, subject = random_gapped_pair(rng)
+        q_anchor = rng.randint(0, len(query))
+        s_anchor = rng.randint(0, len(subject))
+        score, q_start, q_end, s_start, s_end, ops = blastn_numpy.banded_gapped_extend(
+            blastn_numpy.codes(query), blastn_numpy.codes(subject), q_anchor, s_anchor,
+            rng.choice([2, 4, 16]), rng.choice([10, 30]))
+        assert ops_score(query, subject, q_start, s_start, ops) == (score, q_end, s_end)
+
+
+def test_gapped_score_matches_affine_dp():
+    # with a band and X-drop too wide to cut anything, each side is the
+    # best prefix alignment from the anchor
+    rng = random.Random(0xd9)
+    for _ in range(300):
+        query, subject = random_gapped_pair(rng)
+        q_anchor = rng.randint(0, len(query))
+        s_anchor = rng.randint(0, len(subject))
+        score = blastn_numpy.banded_gapped_extend(
+            blastn_numpy.codes(query), blastn_numpy.codes(subject), q_anchor, s_anchor,
+            len(query) + len(subject) + 2, 1000)[0]
+        assert score == (best_prefix_score(query[q_anchor:], subject[s_anchor:])
+                         + best_prefix_score(query[:q_anchor][::-1], subject[:s_anchor][::-1]))
+
+
+def test_gapped_hits_score_their_ops():
+    rng = random.Random(0x6a9)
+    for _ in range(3):
+        queries, database = random_search(rng)
+        # gaps in the database copies
+        for i, subject in enumerate(database):
+            at = rng.randint(0, len(subject))
+            database[i] = subject[:at] + subject[at + rng.randint(0, 3):]
+        searcher = blastn.Searcher(database, k=8)
+        for query in queries:
+            for res in searcher.search(query, {"gapped": True, "strand": "both"})[0]:
+                if res.ops is None:
+                    continue
+                aligned_query, aligned_subject = res.aligned(query, database)
+                score = matches = 0
+                gap = None
+                for a, b in zip(aligned_query, aligned_subject):
+                    if "-" in (a, b):
+                        score += GAP_EXTEND + (GAP_OPEN if gap != (a == "-") else 0)
+                        gap = a == "-"
+                        continue
+                    gap = None
+                    score += MATCH if a == b else MISMATCH
+                    matches += a == b
+                assert (score, matches, len(aligned_query)) == (res.score, res.matches, res.length)
@@ -0,0 +1,72 @@
+#=========================================================================
+# blastn_packed_test.py
+#=========================================================================
+# Round trips through the 2-bit packed database format.
+
+import random
+
+import pytest
+
+import blastn
+import blastn_packed
+from conftest import keys, random_bases, random_search, write_database
+
+
+def pack(tmp_path, subjects):
+    text_path = write_database(tmp_path / "db.txt", subjects)
+    packed_path = str(tmp_path / "db.pk")
+    assert blastn_packed.pack_database(text_path, packed_path) == len(subjects)
+    return packed_path
+
+
+def test_round_trip(tmp_path):
+    rng = random.Random(0x9ac)
+    # lengths either side of a byte and of a 16-base word
+    subjects = [random_bases(rng, n) for n in (1, 3, 4, 5, 15, 16, 17, 31, 33, 200)]
+    with blastn_packed.PackedDatabase(pack(tmp_path, subjects)) as database:
+        assert len(database) == len(subjects)
+        assert list(database) == subjects
+        for subject_index, subject in enumerate(subjects):
+            assert database[subject_index] == subject
+            assert database.subject_length(subject_index) == len(subject)
+            offset, nbytes = database.packed_range(subject_index)
+            # every subject starts on a 32-bit word and fills whole words
+            assert offset % blastn_packed.WORD_BYTES == 0
+            assert nbytes * 4 == -(-len(subject) // 16) * 16
+            assert database.subject_at(offset) == subject_index
+            for _ in range(10):
+                start = rng.randint(0, len(subject))
+                end = rng.randint(start, len(subject))
+                assert database.decode(subject_index, start, end) == subject[start:end]
+
+
+def test_bit_layout(tmp_path):
+    # base j of a byte in bits [2j+1:2j], A=0 C=1 G=2 T=3, as the xcel reads it
+    with blastn_packed.PackedDatabase(pack(tmp_path, ["ACGTTGCA"])) as database:
+        packed = database.packed(0)
+        assert bytes(packed[:2]) == bytes([0b11100100, 0b00011011])
+        packed.release()
+
+
+def test_load_database_detects_packed(tmp_path):
+    subjects = ["ACGT", "GGGTTTAAAC"]
+    assert blastn_packed.is_packed(pack(tmp_path, subjects))
+    assert not blastn_packed.is_packed(str(tmp_path / "db.txt"))
+    database = blastn.load_database(str(tmp_path / "db.pk"))
+    assert list(database) == subjects
+    database.close()
+
+
+def test_non_acgt_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        pack(tmp_path, ["ACGTNACGT"])
+
+
+def test_packed_search_matches_text_search(tmp_path):
+    rng = random.Random(0x5ea)
+    queries, subjects = random_search(rng)
+    database = blastn.load_database(pack(tmp_path, subjects))
+    packed_searcher = blastn.Searcher(database, k=4)
+    text_searcher = blastn.Searcher(subjects, k=4)
+    for query in queries:
+        assert keys(packed_searcher.search(query)) == keys(text_searcher.search(query))
@@ -0,0 +1,77 @@
+#=========================================================================
+# blastn_prefetch_test.py
+#=========================================================================
+# Read-ahead scans of a packed database against indexing it directly.
+
+import random
+
+import pytest
+
+import blastn_packed
+import blastn_prefetch
+from conftest import random_bases, write_database
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    # (packed database, subjects) with blocks of a few subjects each
+    rng = random.Random(0x9ef)
+    subjects = [random_bases(rng, rng.randint(1, 90)) for _ in range(40)]
+    path = write_database(tmp_path / "db.txt", subjects)
+    blastn_packed.pack_database(path, str(tmp_path / "db.pk"))
+    monkeypatch.setattr(blastn_prefetch, "BLOCK_BYTES", 64)
+    with blastn_packed.PackedDatabase(str(tmp_path / "db.pk")) as packed:
+        yield packed, subjects
+
+
+def test_scan_yields_the_subjects(database):
+    packed, subjects = database
+    rng = random.Random(0x5ca)
+    selections = [None, range(0), range(7, 8), range(3, 31), [0, 39], list(range(0, 40, 3))]
+    selections += [sorted(rng.sample(range(40), rng.randint(2, 40))) for _ in range(20)]
+    for subject_indices in selections:
+        expected = range(40) if subject_indices is None else subject_indices
+        assert list(blastn_prefetch.subjects(packed, subject_indices)) == [
+            (subject_index, subjects[subject_index]) for subject_index in expected]
+
+
+def test_text_databases_are_indexed(database):
+    packed, subjects = database
+    assert list(blastn_prefetch.subjects(subjects, [2, 5])) == [(2, subjects[2]),
+                                                                (5, subjects[5])]
+
+
+def test_read_errors_reach_the_scan(database, monkeypatch):
+    packed, subjects = database
+
+    def fail(lo, hi):
+        raise OSError("storage went away")
+    monkeypatch.setattr(packed, "read", fail)
+    with pytest.raises(OSError):
+        list(blastn_prefetch.subjects(packed))
+
+
+def test_abandoned_scan_stops_the_reader(database):
+    packed, subjects = database
+    scan = blastn_prefetch.subjects(packed)
+    assert next(scan) == (0, subjects[0])
+    # closing the scan joins the reader thread, which must not hang on the
+    # full queue
+    scan.close()
+
+
+def test_skipped_subjects_are_not_read(database, monkeypatch):
+    packed, subjects = database
+    rng = random.Random(0x5c1)
+    read = []
+    packed_read = packed.read
+
+    def recorded(lo, hi):
+        read.extend(range(lo, hi))
+        return packed_read(lo, hi)
+    monkeypatch.setattr(packed, "read", recorded)
+    for _ in range(20):
+        subject_indices = sorted(rng.sample(range(40), rng.randint(2, 20)))
+        del read[:]
+        list(blastn_prefetch.subjects(packed, subject_indices))
+        assert read == subject_indices
@@ -0,0 +1,86 @@
+#=========================================================================
+# blastn_profile_test.py
+#=========================================================================
+# Profiling times and counts the pipeline without changing its results.
+
+import json
+import random
+from collections import Counter
+
+import pytest
+
+import blastn
+import blastn_profile
+from conftest import keys, random_search, write_database
+
+PARAMS = [{}, {"strand": "both", "top": 4}, {"two_hit": 20}, {"mem": True},
+          {"exact": True, "dedup": False}]
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_profile_counts_the_search(params):
+    rng = random.Random(0x9f1)
+    queries, subjects = random_search(rng)
+    searcher = blastn.Searcher(subjects, k=4)
+    for query in queries:
+        profile = blastn_profile.Profile()
+        searched = searcher.search(query, params, profile)
+        assert keys(searched) == keys(searcher.search(query, params))
+        counts = profile.counts
+        assert counts["results"] == len(searched[0])
+        assert counts["words"] <= len(query) * 2
+        assert counts["seed_hits"] >= counts["extensions"] or params.get("exact")
+        assert counts["bases_compared"] >= counts["xdrop_terminations"]
+        assert {"preprocess_query", "seed_searching", "extend_alignment",
+                "filter"} <= set(profile.times)
+        report = profile.report()
+        assert sum(report["seconds"].values()) <= report["total_seconds"]
+
+
+def test_seed_hits_are_the_seeds():
+    rng = random.Random(0x5ee)
+    queries, subjects = random_search(rng)
+    searcher = blastn.Searcher(subjects, k=4)
+    for query in queries:
+        words = blastn.preprocess_query(query, 4)
+        profile = blastn_profile.Profile()
+        searcher.search(query, {"dedup": False}, profile)
+        seeds = list(searcher.seed_searching(words))
+        assert profile.counts["words"] == len(words)
+        assert profile.counts["seed_hits"] == profile.counts["extensions"] == len(seeds)
+
+
+@pytest.mark.parametrize("params", PARAMS)
+def test_batch_counts_its_queries(params):
+    rng = random.Random(0xba7)
+    queries, subjects = random_search(rng)
+    searcher = blastn.Searcher(subjects, k=4)
+    expected = Counter()
+    for query in queries:
+        profile = blastn_profile.Profile()
+        searcher.search(query, params, profile)
+        expected.update(profile.counts)
+    profile = blastn_profile.Profile()
+    searched = searcher.batch_search(queries, params, profile)
+    assert [keys(result) for result in searched] == [
+        keys(result) for result in searcher.batch_search(queries, params)]
+    assert profile.counts == expected
+
+
+def test_null_profile_passes_items_through():
+    profile = blastn_profile.NullProfile()
+    items = iter([1, 2])
+    assert profile.timed("stage", items, "results") is items
+    with profile.stage("stage"):
+        pass
+    assert profile.counts is None
+
+
+def test_cli_writes_the_profile(tmp_path, monkeypatch, capsys):
+    path = write_database(tmp_path / "db.txt", ["ACGTACGTTTGACCA", "GGACGTACGAT"])
+    monkeypatch.setattr("sys.argv", ["blastn.py", path, "--no-index-cache", "--query",
+                                     "ACGTACGT", "--profile", "-"])
+    blastn.main()
+    report = json.loads(capsys.readouterr().err)
+    assert {"load_database", "seed_searching", "output"} <= set(report["seconds"])
+    assert report["counters"]["words"] == len("ACGTACGT") - blastn.kmer + 1
@@ -0,0 +1,91 @@
+#=========================================================================
+# blastn_sa_test.py
+#=========================================================================
+# The suffix array against a plain sort of the suffixes, and seeding from
+# it against the k-mer index, word by word and by maximal exact matches.
+
+import random
+
+import pytest
+
+import blastn
+import blastn_sa
+from conftest import has_numpy, keys, random_bases, random_search, write_database
+
+
+def random_text(rng):
+    # code bytes over a small alphabet, often one repeated unit, so many
+    # suffixes share long prefixes
+    alphabet = rng.choice([b"\x00", b"\x00\x01", b"\x00\x01\x02\x03\x04"])
+    n = rng.randint(0, 300)
+    if rng.random() < 0.5:
+        unit = bytes(rng.choice(alphabet) for _ in range(rng.randint(1, 5)))
+        return (unit * (n // len(unit) + 1))[:n]
+    return bytes(rng.choice(alphabet) for _ in range(n))
+
+
+def builders():
+    found = [blastn_sa._suffix_array_groups]
+    if has_numpy():
+        import numpy
+        found.append(lambda text: blastn_sa._suffix_array_numpy(numpy, text))
+    return found
+
+
+@pytest.mark.parametrize("build", builders())
+def test_suffix_array_sorts_suffixes(build):
+    rng = random.Random(0x5a)
+    for _ in range(400):
+        text = random_text(rng)
+        # the end of the text sorts before every code
+        shifted = text.translate(bytes(b + 1 for b in range(255)) + b"\xff")
+        assert list(build(text)) == sorted(range(len(text)), key=lambda i: shifted[i:])
+
+
+def test_maximal_matches_match_a_scan(tmp_path):
+    rng = random.Random(0x3e3)
+    subjects = [random_bases(rng, rng.randint(1, 40)) * rng.randint(1, 3) for _ in range(20)]
+    subjects.append("A" * 60)
+    path = write_database(tmp_path / "db.txt", subjects)
+    text = blastn.Searcher.open(path, k=3, suffix_array=True).suffix_array
+    data = b"".join(blastn_sa.text_codes(subject) + bytes([blastn_sa.STOP])
+                    for subject in subjects)
+    for _ in range(300):
+        query = rng.choice([random_bases(rng, 40), rng.choice(subjects)[rng.randint(0, 5):]])
+        codes = blastn_sa.query_codes(query)
+        k = rng.choice([3, 4, 6])
+        start = rng.randint(0, len(codes))
+        expected = []
+        for p in range(len(data)):
+            n = 0
+            while start + n < len(codes) and data[p + n] == codes[start + n]:
+                n += 1
+            if n >= k and not (start and p and data[p - 1] == codes[start - 1]):
+                expected.append((n, p))
+        assert sorted(text.maximal_matches(codes, start, k)) == sorted(expected)
+
+
+@pytest.mark.parametrize("k", [3, 4, 8])
+@pytest.mark.parametrize("params", [{}, {"strand": "both"}, {"shard": (2, 7)}, {"mem": True},
+                                    {"mem": True, "strand": "both", "shard": (3, 9)}])
+def test_seeding_matches_kmer_index(tmp_path, k, params):
+    rng = random.Random(0x5ee)
+    for trial in range(3):
+        queries, subjects = random_search(rng)
+        subjects.append("A" * 50 + "C" + "ACGTT" * 5)
+        path = write_database(tmp_path / f"db{trial}.txt", subjects)
+        suffix_array = blastn.Searcher.open(path, k=k, suffix_array=True)
+        index = blastn.Searcher(subjects, k=k)
+        for query in queries + ["A" * 30, "ACGTNACGT"]:
+            assert keys(suffix_array.search(query, params)) == keys(index.search(query, params))
+
+
+def test_masked_seeding_matches_kmer_index(tmp_path):
+    rng = random.Random(0xd5a)
+    queries, subjects = random_search(rng)
+    path = write_database(tmp_path / "db.txt", subjects)
+    suffix_array = blastn.Searcher.open(path, k=4, dust=20, suffix_array=True)
+    index = blastn.Searcher(subjects, k=4, dust=20)
+    for query in queries + ["AT" * 20]:
+        params = {"strand": "both", "dust": 20}
+        assert keys(suffix_array.search(query, params)) == keys(index.search(query, params))
@@ -0,0 +1,128 @@
+#=========================================================================
+# blastn_server_test.py
+#=========================================================================
+# The warm search service over a Unix socket.
+
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+import blastn
+import blastn_server
+from conftest import random_search, write_database
+
+
+@pytest.fixture
+def server(tmp_path):
+    # (searcher, queries, socket path) of a service running in a thread
+    rng = random.Random(0x5e7)
+    queries, subjects = random_search(rng)
+    searcher = blastn.Searcher(subjects, k=4)
+    path = str(tmp_path / "blastn.sock")
+    running = {}
+
+    async def run():
+        running["loop"] = asyncio.get_running_loop()
+        running["task"] = asyncio.current_task()
+        try:
+            await blastn_server.serve(searcher, path, 2)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=asyncio.run, args=(run(),))
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not os.path.exists(path):
+        assert thread.is_alive() and time.monotonic() < deadline
+        time.sleep(0.01)
+    yield searcher, queries, path
+    running["loop"].call_soon_threadsafe(running["task"].cancel)
+    thread.join()
+
+
+def test_replies_are_searches(server):
+    searcher, queries, path = server
+    for query in queries:
+        for params in ({}, {"top": 3, "strand": "both"}):
+            results, best = searcher.search(query, params)
+            reply = blastn_server.request(path, query, params)
+            assert reply == json.loads(json.dumps({
+                "results": [res.as_list(query, searcher.subjects) for res in results],
+                "best": [res.as_list(query, searcher.subjects) for res in best]}))
+
+
+def test_failed_requests_reply_with_errors(server):
+    searcher, queries, path = server
+    lines = [b"not json",
+             b"[]",
+             json.dumps({"params": {}}).encode(),
+             json.dumps({"query": queries[0], "params": {"colour": "red"}}).encode(),
+             json.dumps({"query": queries[0], "params": {"strand": "minus"}}).encode(),
+             json.dumps({"query": queries[0], "params": [1]}).encode(),
+             json.dumps({"query": queries[0], "params": {"shard": [0, 999],
+                                                         "exact": True}}).encode()]
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        with sock.makefile("rb") as file:
+            for line in lines:
+                sock.sendall(line + b"\n")
+                assert set(json.loads(file.readline())) == {"error"}
+            # the connection still serves
+            sock.sendall(json.dumps({"query": queries[0]}).encode() + b"\n")
+            assert set(json.loads(file.readline())) == {"results", "best"}
+
+
+def test_missing_numpy_is_an_error(server, monkeypatch):
+    searcher, queries, path = server
+    monkeypatch.setitem(sys.modules, "numpy", None)
+    monkeypatch.setitem(sys.modules, "blastn_numpy", None)
+    reply = blastn_server.request(path, queries[0], {"engine": "numpy"})
+    assert "numpy" in reply["error"]
+
+
+def test_stale_socket_is_replaced(tmp_path):
+    path = str(tmp_path / "blastn.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(path)
+    searcher = blastn.Searcher(["ACGTACGT"], k=4)
+
+    async def start_and_stop():
+        serving = asyncio.ensure_future(blastn_server.serve(searcher, path, 1))
+        await asyncio.sleep(0.1)
+        assert not serving.done()
+        serving.cancel()
+    asyncio.run(start_and_stop())
+
+
+def test_other_files_are_not_removed(tmp_path):
+    other = tmp_path / "blastn.sock"
+    other.write_text("keep me")
+    searcher = blastn.Searcher(["ACGTACGT"], k=4)
+    with pytest.raises(OSError):
+        asyncio.run(blastn_server.serve(searcher, str(other), 1))
+    assert other.read_text() == "keep me"
+
+
+def test_main_opens_the_database_with_its_options(tmp_path, monkeypatch):
+    path = write_database(tmp_path / "db.txt", ["ACGTACGTTTGACCA" * 20])
+    served = {}
+
+    async def serve(searcher, socket_path, threads):
+        served["searcher"] = searcher
+    monkeypatch.setattr(blastn_server, "serve", serve)
+    monkeypatch.setattr("sys.argv", ["blastn_server.py", path, "--no-index-cache",
+                                     "--dust", "30", "--minimizer", "3", "--chunk", "60",
+                                     "--overlap", "90"])
+    blastn_server.main()
+    searcher = served["searcher"]
+    assert (searcher.k, searcher.seed, searcher.dust, searcher.suffix_array,
+            searcher.minimizer, searcher.chunk, searcher.overlap) == (
+        blastn.kmer, None, 30, None, 3, 60, 90)
+    assert not [name for name in os.listdir(tmp_path) if name != "db.txt"]
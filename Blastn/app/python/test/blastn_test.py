@@ -0,0 +1,394 @@
+#=========================================================================
+# blastn_test.py
+#=========================================================================
+# Tests for the search pipeline of blastn.py.
+
+import random
+from collections import Counter
+
+import pytest
+
+import blastn
+import blastn_profile
+from conftest import hit_key, keys, random_bases, random_search, write_database
+
+#-------------------------------------------------------------------------
+# k-mer index
+#-------------------------------------------------------------------------
+
+
+def brute_force_hits(database, words, k, care=None):
+    # every occurrence of every word matching on the care positions (all
+    # of them by default) where those are ACGT, in the order seeding
+    # streams them
+    care = range(k) if care is None else care
+    hits = []
+    for subject_index, subject in enumerate(database):
+        at = {}
+        for pos in range(len(subject) - k + 1):
+            at.setdefault("".join(subject[pos + i] for i in care), []).append(pos)
+        for word_index, word in enumerate(words):
+            cared = "".join(word[i] for i in care)
+            if not set(cared) - set("ACGT"):
+                hits += [[k, subject_index, word_index, pos, 0] for pos in at.get(cared, [])]
+    hits.sort(key=lambda hsp: (hsp[1], hsp[4], hsp[2], hsp[3]))
+    return hits
+
+
+@pytest.mark.parametrize("k", [3, 4, 8])
+def test_index_seeds_every_word_occurrence(k):
+    rng = random.Random(0x1d8)
+    for _ in range(5):
+        queries, database = random_search(rng)
+        # non-ACGT bases start no word
+        database.append(random_bases(rng, 20) + "NN" + random_bases(rng, 20))
+        searcher = blastn.Searcher(database, k=k)
+        for query in queries + ["ACGNTACGT"]:
+            words = blastn.preprocess_query(query, k)
+            assert list(searcher.seed_searching(words)) == brute_force_hits(database, words, k)
+
+@pytest.mark.parametrize("seed", ["1101", "11011011", "1110010111"])
+def test_spaced_seed_seeds_every_care_match(seed):
+    rng = random.Random(0x5ee)
+    k = len(seed)
+    care = [i for i, c in enumerate(seed) if c == "1"]
+    for _ in range(5):
+        queries, database = random_search(rng)
+        # N on an ignored position does not stop a word
+        database.append("ACNTACGTAC" + random_bases(rng, 20))
+        searcher = blastn.Searcher(database, seed=seed)
+        for query in queries + ["ACGTACGTAC"]:
+            words = blastn.preprocess_query(query, k)
+            assert (list(searcher.seed_searching(words))
+                    == brute_force_hits(database, words, k, care))
+
+
+def test_spaced_seed_is_validated():
+    for seed in ("", "0110", "1100", "1121"):
+        with pytest.raises(ValueError):
+            blastn.Searcher(["ACGT"], seed=seed)
+
+#-------------------------------------------------------------------------
+# both strands
+#-------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("options", [{"k": 4}, {"seed": "11011"}])
+def test_both_strands_search_the_reverse_complement(options):
+    # minus-strand hits are the plus-strand hits of the reverse-complemented
+    # query, in subject order after the plus-strand hits of their subject
+    rng = random.Random(0x2d)
+    for _ in range(5):
+        queries, database = random_search(rng)
+        searcher = blastn.Searcher(database, **options)
+        for query in queries:
+            plus = keys(searcher.search(query))[0]
+            minus = [key[:9] + (1,) for key
+                     in keys(searcher.search(blastn.reverse_complement(query)))[0]]
+            both = keys(searcher.search(query, {"strand": "both"}))[0]
+            assert both == sorted(plus + minus, key=lambda key: (key[4], key[9]))
+
+
+def test_reverse_complement():
+    assert blastn.reverse_complement("AACGTN") == "NACGTT"
+    with pytest.raises(ValueError):
+        blastn.search_params({"strand": "minus"})
+
+#-------------------------------------------------------------------------
+# sharded search
+#-------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("index_cache", [False, True])
+@pytest.mark.parametrize("params", [{}, {"top": 5}, {"per_subject": 1, "strand": "both"}])
+def test_parallel_matches_serial(tmp_path, index_cache, params):
+    rng = random.Random(0x9a7)
+    queries, subjects = random_search(rng, n_subjects=20)
+    path = write_database(tmp_path / "db.txt", subjects)
+    searcher = blastn.Searcher(subjects, k=4)
+    for query in queries[:2]:
+        searched = blastn.parallel_search(path, len(subjects), 3, query, params, index_cache,
+                                          k=4)
+        assert keys(searched) == keys(searcher.search(query, params))
+
+#-------------------------------------------------------------------------
+# two-hit seeding
+#-------------------------------------------------------------------------
+
+
+def brute_force_two_hit(hsps, k, window):
+    # chain each diagonal's hits in position order: a hit overlapping the
+    # last kept one is dropped, one at most window after it triggers
+    diagonals = {}
+    for hsp in hsps:
+        diagonals.setdefault((hsp[1], hsp[4], hsp[3] - hsp[2]), []).append(hsp)
+    triggered = set()
+    for chain in diagonals.values():
+        last = None
+        for hsp in sorted(chain, key=lambda hsp: hsp[3]):
+            if last is not None and hsp[3] - last < k:
+                continue
+            if last is not None and hsp[3] - last <= window:
+                triggered.add(tuple(hsp))
+            last = hsp[3]
+    return [hsp for hsp in hsps if tuple(hsp) in triggered]
+
+
+@pytest.mark.parametrize("window", [8, 40])
+def test_two_hit_keeps_second_hits_within_window(window):
+    rng = random.Random(0x2e7)
+    for _ in range(5):
+        queries, database = random_search(rng)
+        searcher = blastn.Searcher(database, k=4)
+        for query in queries:
+            hsps = list(searcher.seed_searching(blastn.preprocess_query(query, 4)))
+            assert (list(searcher.two_hit(iter(hsps), window))
+                    == brute_force_two_hit(hsps, 4, window))
+            # two-hit results are the one-hit extensions of triggering hits
+            one_hit = Counter(keys(searcher.search(query, {"dedup": False}))[0])
+            two_hit = Counter(keys(searcher.search(query, {"dedup": False,
+                                                           "two_hit": window}))[0])
+            assert not two_hit - one_hit
+
+#-------------------------------------------------------------------------
+# diagonal-coverage dedup
+#-------------------------------------------------------------------------
+
+
+def covered_seeds(database, query, hsps, k, xdrop):
+    # the seeds a dedup search extends: a hit is skipped when its word ends
+    # inside an extension already made on its diagonal
+    ends = {}
+    extended = set()
+    for _, subject_index, word_index, subject_pos, strand in hsps:
+        diagonal = (subject_index, strand, subject_pos - word_index)
+        if subject_pos + k <= ends.get(diagonal, -1):
+            continue
+        score, q_start, q_end, s_start = blastn.ungapped_extend(
+            query, database[subject_index], word_index, subject_pos, k, xdrop)
+        ends[diagonal] = max(ends.get(diagonal, -1), s_start + q_end - q_start)
+        extended.add((subject_index, word_index, subject_pos))
+    return extended
+
+
+def test_dedup_skips_covered_hits():
+    rng = random.Random(0xded)
+    for _ in range(5):
+        queries, database = random_search(rng)
+        database.append("ACGT" * 50)
+        searcher = blastn.Searcher(database, k=4)
+        for query in queries + ["ACGT" * 10]:
+            hsps = list(searcher.seed_searching(blastn.preprocess_query(query, 4)))
+            extended = covered_seeds(database, query, hsps, 4, blastn.default_params["xdrop"])
+            profile = blastn_profile.Profile()
+            results = searcher.search(query, {}, profile)[0]
+            everything = searcher.search(query, {"dedup": False})[0]
+            assert profile.counts["extensions"] == len(extended)
+            assert [hit_key(res) for res in results] == [
+                hit_key(res) for res in everything
+                if (res.subject_index, res.word_index, res.subject_pos) in extended]
+
+#-------------------------------------------------------------------------
+# batch search
+#-------------------------------------------------------------------------
+
+
+@pytest.mark.parametrize("options, params", [
+    ({"k": 4}, {}),
+    ({"k": 4}, {"two_hit": 20}),
+    ({"k": 4}, {"dedup": False}),
+    ({"k": 4}, {"top": 6}),
+    ({"k": 4}, {"top": 3, "per_subject": 1}),
+    ({"seed": "1101011"}, {}),
+    ({"k": 4}, {"strand": "both", "top": 6}),
+    ({"k": 4, "dust": 20}, {"strand": "both", "dust": 20}),
+    ({"k": 4, "minimizer": 5}, {"strand": "both"}),
+    ({"k": 4, "chunk": 30, "overlap": 120}, {}),
+    ({"k": 4, "chunk": 30, "overlap": 120}, {"strand": "both", "top": 6}),
+    ({"k": 4}, {"exact": True}),
+    ({"k": 4}, {"exact": True, "strand": "both", "top": 6}),
+])
+def test_batch_matches_search(options, params):
+    rng = random.Random(0xba7)
+    for _ in range(5):
+        queries, database = random_search(rng)
+        # a query occurring verbatim in the database
+        queries.append(rng.choice(database)[5:35])
+        searcher = blastn.Searcher(database, **options)
+        expected = [keys(searcher.search(query, params)) for query in queries]
+        assert [keys(searched) for searched in searcher.batch_search(queries, params)] == expected
+
+
+def test_queries_need_a_single_process(tmp_path, monkeypatch):
+    monkeypatch.setattr("sys.argv", ["blastn.py", write_database(tmp_path / "db.txt", ["ACGT"]),
+                                     "--queries", "queries.txt", "--jobs", "2"])
+    with pytest.raises(SystemExit):
+        blastn.main()
+
+
+def test_queries_print_every_query_search(tmp_path, monkeypatch, capsys):
+    rng = random.Random(0xc11)
+    queries, subjects = random_search(rng, n_queries=3)
+    path = write_database(tmp_path / "db.txt", subjects)
+    (tmp_path / "queries.txt").write_text("".join(query + "\n" for query in queries))
+
+    def run(*args):
+        monkeypatch.setattr("sys.argv", ["blastn.py", path, "--no-index-cache", *args])
+        blastn.main()
+        return capsys.readouterr().out.splitlines()
+
+    expected = [str(len(subjects))]
+    for query_id, query in enumerate(queries):
+        # the single-query run prints the subject count and query words first
+        expected += [f"Query #{query_id}: {query}"] + run("--query", query)[2:]
+    assert run("--queries", str(tmp_path / "queries.txt")) == expected
+
+#-------------------------------------------------------------------------
+# top-K results
+#-------------------------------------------------------------------------
+
+
+def sorted_top(results, top, per_subject):
+    # the reference selection: sort everything, then cap
+    ranked = sorted(results, key=blastn.TopHits.rank, reverse=True)
+    if per_subject:
+        taken = Counter()
+        capped = []
+        for res in ranked:
+            taken[res.subject_index] += 1
+            if taken[res.subject_index] <= per_subject:
+                capped.append(res)
+        ranked = capped
+    return ranked[:top] if top else ranked
+
+
+@pytest.mark.parametrize("top, per_subject", [(1, 0), (7, 0), (7, 2), (0, 1), (50, 3)])
+def test_top_hits_match_a_full_sort(top, per_subject):
+    rng = random.Random(0x70b)
+    for _ in range(50):
+        # few distinct scores, so ties decide what is kept
+        results = [blastn.Hit(rng.randint(0, 5), 0, pos, 10, subject_index, 10,
+                              rng.randint(0, 20), pos, None, strand)
+                   for subject_index in range(rng.randint(1, 8))
+                   for strand in (0, 1)
+                   for pos in sorted(rng.sample(range(100), rng.randint(0, 6)))]
+        top_hits = blastn.TopHits(top, per_subject)
+        top_hits.extend(results)
+        assert top_hits.results() == sorted_top(results, top, per_subject)
+
+
+@pytest.mark.parametrize("params", [{"top": 5}, {"per_subject": 1}, {"top": 3, "per_subject": 2}])
+def test_search_keeps_the_best_results(params):
+    rng = random.Random(0xb57)
+    queries, database = random_search(rng)
+    searcher = blastn.Searcher(database, k=4)
+    for query in queries:
+        everything = searcher.search(query)[0]
+        expected = sorted_top(everything, params.get("top", 0), params.get("per_subject", 0))
+        results = searcher.search(query, params)[0]
+        assert [hit_key(res) for res in results] == [hit_key(res) for res in expected]
+
+#-------------------------------------------------------------------------
+# streaming pipeline
+#-------------------------------------------------------------------------
+
+
+def test_results_stream_as_seeds_arrive():
+    # the first result comes out before the seeding has run to the end
+    rng = random.Random(0x57e)
+    queries, database = random_search(rng)
+    searcher = blastn.Searcher(database, k=4)
+    for query in queries:
+        taken = Counter()
+        seed_searching = searcher.seed_searching
+
+        def counted(*args):
+            for hsp in seed_searching(*args):
+                taken["seeds"] += 1
+                yield hsp
+        searcher.seed_searching = counted
+        params = blastn.search_params()
+        best_results = []
+        stream = searcher.stream(query, params, best_results)
+        first = next(stream)
+        assert taken["seeds"] < len(list(seed_searching(blastn.preprocess_query(query, 4))))
+        rest = list(stream)
+        del searcher.seed_searching
+        expected = searcher.search(query)
+        assert keys(([first] + rest, best_results)) == keys(expected)
+
+#-------------------------------------------------------------------------
+# X-drop extension
+#-------------------------------------------------------------------------
+
+
+def stepwise_extend(query, subject, word_index, subject_pos, k, xdrop, seed_score):
+    # ungapped_extend() from the list of lockstep steps: step t scores the
+    # pairs t bases left of the word and t bases right of it, where there
+    # are bases on both sequences
+    left = min(word_index, subject_pos)
+    right = min(len(query) - word_index - k, len(subject) - subject_pos - k)
+    pair = lambda a, b: 1 if a == b else -3
+    scores = [seed_score]
+    compared = 0
+    dropped = False
+    for t in range(1, max(left, right) + 1):
+        step = 0
+        if t <= left:
+            step += pair(query[word_index - t], subject[subject_pos - t])
+        if t <= right:
+            step += pair(query[word_index + k - 1 + t], subject[subject_pos + k - 1 + t])
+        compared += (t <= left) + (t <= right)
+        if max(scores) - (scores[-1] + step) > xdrop:
+            dropped = True
+            break
+        scores.append(scores[-1] + step)
+    best = max(scores)
+    # the last step reaching the best score
+    t = max(t for t, score in enumerate(scores) if score == best)
+    stats = {"bases_compared": compared, "xdrop_terminations": int(dropped)}
+    return (best, word_index - min(t, left), word_index + k + min(t, right),
+            subject_pos - min(t, left)), stats
+
+
+def test_extension_stops_at_the_xdrop():
+    rng = random.Random(0x6d7)
+    for _ in range(3000):
+        k = rng.choice([3, 4, 11])
+        query = random_bases(rng, rng.randint(k, 80))
+        start = rng.randint(0, len(query) - k)
+        subject = (random_bases(rng, rng.randint(0, 20))
+                   + "".join(rng.choice("ACGT") if rng.random() < 0.15 else base
+                             for base in query[rng.randint(0, start):])
+                   + random_bases(rng, rng.randint(0, 20)))
+        word_index = rng.randint(0, len(query) - k)
+        subject_pos = rng.randint(0, len(subject) - k)
+        xdrop = rng.choice([0, 3, 10, 20, 1000])
+        seed_score = rng.choice([k, k - 4])
+        stats = {"bases_compared": 0, "xdrop_terminations": 0}
+        assert (blastn.ungapped_extend(query, subject, word_index, subject_pos, k, xdrop,
+                                       seed_score, stats), stats) == stepwise_extend(
+            query, subject, word_index, subject_pos, k, xdrop, seed_score)
+
+#-------------------------------------------------------------------------
+# compact hits
+#-------------------------------------------------------------------------
+
+
+def test_hits_build_their_alignments_on_request():
+    rng = random.Random(0x417)
+    queries, database = random_search(rng)
+    searcher = blastn.Searcher(database, k=4)
+    for query in queries:
+        for res in searcher.search(query, {"strand": "both"})[0]:
+            # coordinates only, no per-hit dict or strings
+            assert not hasattr(res, "__dict__") and res.ops is None
+            seq = blastn.reverse_complement(query) if res.strand else query
+            aligned_query, aligned_subject = res.aligned(query, database)
+            assert aligned_query == seq[res.q_start:res.q_start + res.length]
+            assert aligned_subject == database[res.subject_index][
+                res.s_start:res.s_start + res.length]
+            assert res.matches == sum(a == b for a, b in zip(aligned_query, aligned_subject))
+            assert res.as_list(query, database) == [
+                res.score, aligned_query, aligned_subject, res.subject_index, res.word_index,
+                res.subject_pos, res.matches / res.length * 100] + ["minus"] * res.strand
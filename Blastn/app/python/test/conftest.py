@@ -0,0 +1,64 @@
+#=========================================================================
+# conftest.py
+#=========================================================================
+# Shared setup for the blastn.py tests. The modules under test sit one
+# directory up; the helpers build random sequences, databases with
+# mutated copies of the queries in them, and comparable keys of results.
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import blastn  # noqa: E402
+
+
+def random_bases(rng, n):
+    return "".join(rng.choice("ACGT") for _ in range(n))
+
+
+def mutate(rng, seq, rate):
+    return "".join(rng.choice("ACGT") if rng.random() < rate else c for c in seq)
+
+
+def random_search(rng, n_subjects=12, n_queries=4):
+    # queries and a database holding mutated pieces of them, some on the
+    # minus strand and some followed by a low-complexity run
+    queries = [random_bases(rng, rng.randint(30, 120)) for _ in range(n_queries)]
+    database = []
+    for _ in range(n_subjects):
+        query = rng.choice(queries)
+        start = rng.randint(0, len(query) - 20)
+        piece = mutate(rng, query[start:start + rng.randint(20, 80)], rng.choice([0, 0.05, 0.1]))
+        if rng.random() < 0.3:
+            piece = blastn.reverse_complement(piece)
+        if rng.random() < 0.2:
+            piece += "AT" * 20
+        database.append(random_bases(rng, rng.randint(0, 60)) + piece
+                        + random_bases(rng, rng.randint(0, 60)))
+    return queries, database
+
+
+def write_database(path, subjects):
+    path.write_text("\n".join(subjects) + "\n")
+    return str(path)
+
+
+def hit_key(res):
+    return (res.score, res.q_start, res.s_start, res.length, res.subject_index, res.matches,
+            res.word_index, res.subject_pos, res.ops, res.strand)
+
+
+def keys(searched):
+    # (results, best ties) of a search as comparable tuples
+    results, best_results = searched
+    return [hit_key(res) for res in results], [hit_key(res) for res in best_results]
+
+
+def has_numpy():
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True